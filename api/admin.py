@@ -11,5 +11,12 @@ admin.site.register(IncomingInventory)
 admin.site.register(DailyInventoryMetrics)
 admin.site.register(OldIncomingInventory)
 admin.site.register(OldUserInventory)
+admin.site.register(DailySalesRollup)
+admin.site.register(ProjectionChange)
+admin.site.register(ProjectionSweep)
+admin.site.register(RunnerLease)
+admin.site.register(ProjectionRun)
+admin.site.register(OcrResult)
+admin.site.register(OcrJob)
 
 
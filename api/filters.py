@@ -0,0 +1,39 @@
+from datetime import datetime, time, timedelta
+
+from django.db import models
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+
+def _param_date(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValidationError({name: "Must be a valid YYYY-MM-DD date"})
+    return day
+
+
+def date_range(queryset, field, params):
+    """Filter `queryset` to the inclusive ?start=&end= dates on `field`.
+
+    Date times are compared against local midnight bounds rather than
+    through __date, so an index on the column still applies.
+    """
+    start, end = _param_date(params, 'start'), _param_date(params, 'end')
+    if isinstance(queryset.model._meta.get_field(field), models.DateTimeField):
+        if start:
+            queryset = queryset.filter(**{f'{field}__gte': timezone.make_aware(datetime.combine(start, time.min))})
+        if end:
+            queryset = queryset.filter(**{f'{field}__lt': timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))})
+        return queryset
+    if start:
+        queryset = queryset.filter(**{f'{field}__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{field}__lte': end})
+    return queryset
@@ -0,0 +1,264 @@
+"""Bulk import of products, sales and incoming orders from CSV or NDJSON.
+
+Records are parsed one at a time from the open file and written with
+bulk_create a chunk at a time, each chunk in its own transaction, so memory
+stays flat and a bad row only costs that row. Category names and product
+natural keys (product_number, else name) are resolved through maps loaded
+once per import rather than a query per row.
+
+Columns, by kind:
+    products: product_number, name, category, lead_time (optional)
+    sales:    product_number or name, quantity, sale_date (optional, YYYY-MM-DD)
+    incoming: product_number or name, quantity, arrival_date (YYYY-MM-DD)
+"""
+import codecs
+import csv
+import json
+import time
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Category, DailySalesRollup, IncomingInventory, Product, ProjectionChange, Sales
+
+KINDS = ('products', 'sales', 'incoming')
+FORMATS = ('csv', 'ndjson')
+EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+CHUNK_SIZE = 2000
+# Errors kept for the report; the count covers all of them.
+MAX_ERRORS = 100
+
+
+def detect_format(name, fmt=None):
+    """The explicit format if given, else the one implied by the file name."""
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+        return fmt
+    for extension, implied in EXTENSIONS.items():
+        if (name or '').lower().endswith(extension):
+            return implied
+    raise ValueError("Cannot tell the format from the file name; pass csv or ndjson")
+
+
+def check_utf8(chunks):
+    """Raise ValueError unless the byte `chunks` decode as UTF-8.
+
+    Run before importing, since chunks written before a bad byte would stay
+    committed while the import reports failure.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for chunk in chunks:
+            decoder.decode(chunk)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        raise ValueError("The file must be UTF-8 text") from None
+
+
+def records(lines, fmt):
+    """Yield (line number, record) from an iterable of text lines.
+
+    NDJSON records are yielded undecoded so a malformed line is reported
+    against its row instead of ending the import.
+    """
+    if fmt == 'csv':
+        yield from enumerate(csv.DictReader(lines), start=2)
+    else:
+        for number, line in enumerate(lines, start=1):
+            if line.strip():
+                yield number, line
+
+
+def _text(record, name):
+    value = record.get(name)
+    value = '' if value is None else str(value).strip()
+    if not value:
+        raise ValueError(f"{name} is required")
+    return value
+
+
+def _count(record, name, minimum):
+    value = record.get(name)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a whole number") from None
+    if value < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return value
+
+
+def _date(record, name, default=None):
+    value = record.get(name)
+    if value in (None, '') and default is not None:
+        return default
+    try:
+        parsed = parse_date(str(value or '').strip())
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError(f"{name} must be a valid YYYY-MM-DD date")
+    return parsed
+
+
+class Importer:
+    """One import run of `kind` rows; sales and incoming rows belong to `user`."""
+
+    def __init__(self, kind, user=None, chunk_size=CHUNK_SIZE):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown kind {kind!r}; expected one of {', '.join(KINDS)}")
+        if kind != 'products' and user is None:
+            raise ValueError(f"Importing {kind} needs a user")
+        self.kind = kind
+        self.user = user
+        self.chunk_size = max(1, chunk_size)
+        self.today = timezone.localdate()
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+        self.categories = None
+        self.numbers = None
+        self.names = None
+
+    def run(self, lines, fmt):
+        convert = getattr(self, f'_convert_{self.kind}')
+        write = getattr(self, f'_write_{self.kind}')
+        started = time.perf_counter()
+        chunk = []
+        for number, record in records(lines, fmt):
+            try:
+                if isinstance(record, str):
+                    record = json.loads(record)
+                if not isinstance(record, dict):
+                    raise ValueError("Each line must be a JSON object")
+                chunk.append(convert(record))
+            except ValueError as exc:
+                self.error(number, exc)
+                continue
+            if len(chunk) >= self.chunk_size:
+                self._flush(write, chunk)
+                chunk = []
+        self._flush(write, chunk)
+        seconds = time.perf_counter() - started
+        return {
+            'kind': self.kind,
+            'rows': self.imported,
+            'errors': self.error_count,
+            'error_rows': self.errors,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(self.imported / seconds, 1) if seconds else None,
+        }
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({'line': line, 'error': str(message)})
+
+    def _flush(self, write, chunk):
+        if not chunk:
+            return
+        with transaction.atomic():
+            write(chunk)
+        self.imported += len(chunk)
+
+    # Natural keys
+
+    def _product_id(self, record):
+        if self.numbers is None:
+            self.numbers = {}
+            self.names = {}
+            for product_id, product_number, name in Product.objects.values_list('id', 'product_number', 'name'):
+                self.numbers[product_number] = product_id
+                # Names are not unique; an ambiguous one resolves to nothing.
+                self.names[name] = None if name in self.names else product_id
+        product_number = str(record.get('product_number') or '').strip()
+        if product_number:
+            product_id = self.numbers.get(product_number)
+            if product_id is None:
+                raise ValueError(f"Unknown product_number {product_number!r}")
+            return product_id
+        name = _text(record, 'name')
+        if name not in self.names:
+            raise ValueError(f"Unknown product name {name!r}")
+        if self.names[name] is None:
+            raise ValueError(f"Product name {name!r} is ambiguous; use product_number")
+        return self.names[name]
+
+    def _category_ids(self, names):
+        """Category ids by name, creating the ones that do not exist yet."""
+        if self.categories is None:
+            self.categories = dict(Category.objects.values_list('name', 'id'))
+        missing = set(names) - self.categories.keys()
+        if missing:
+            Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+            self.categories.update(Category.objects.filter(name__in=missing).values_list('name', 'id'))
+        return self.categories
+
+    # Products
+
+    def _convert_products(self, record):
+        return {
+            'product_number': _text(record, 'product_number'),
+            'name': _text(record, 'name'),
+            'category': _text(record, 'category'),
+            'lead_time': _count(record, 'lead_time', 0) if record.get('lead_time') not in (None, '') else 0,
+        }
+
+    def _write_products(self, chunk):
+        # A product_number repeated within a chunk is one upsert; the last row wins.
+        rows = {row['product_number']: row for row in chunk}
+        categories = self._category_ids({row['category'] for row in rows.values()})
+        Product.objects.bulk_create(
+            [
+                Product(
+                    product_number=row['product_number'], name=row['name'],
+                    category_id=categories[row['category']], lead_time=row['lead_time'],
+                )
+                for row in rows.values()
+            ],
+            update_conflicts=True,
+            unique_fields=['product_number'],
+            update_fields=['name', 'category', 'lead_time'],
+        )
+        self.numbers = None
+
+    # Sales
+
+    def _convert_sales(self, record):
+        sale = Sales(
+            user=self.user,
+            product_id=self._product_id(record),
+            quantity=_count(record, 'quantity', 1),
+            sale_date=_date(record, 'sale_date', default=self.today),
+        )
+        if sale.sale_date != self.today:
+            # Backdated sales sort and filter by their own day, not the import time.
+            sale.timestamp = timezone.make_aware(datetime.combine(sale.sale_date, datetime.min.time()))
+        return sale
+
+    def _write_sales(self, chunk):
+        Sales.objects.bulk_create(chunk)
+        totals = {}
+        for sale in chunk:
+            key = (sale.user_id, sale.product_id, sale.sale_date)
+            totals[key] = totals.get(key, 0) + sale.quantity
+        DailySalesRollup.objects.add_many(totals)
+        ProjectionChange.objects.mark([(sale.user_id, sale.product_id) for sale in chunk])
+
+    # Incoming orders
+
+    def _convert_incoming(self, record):
+        return (
+            (self.user.id, self._product_id(record), _date(record, 'arrival_date')),
+            _count(record, 'quantity', 1),
+        )
+
+    def _write_incoming(self, chunk):
+        orders = {}
+        for key, quantity in chunk:
+            orders[key] = orders.get(key, 0) + quantity
+        IncomingInventory.objects.add_many(orders)
+        ProjectionChange.objects.mark([(user_id, product_id) for user_id, product_id, _ in orders])
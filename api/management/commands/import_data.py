@@ -0,0 +1,53 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import importer
+from api.models import User
+
+
+class Command(BaseCommand):
+    help = "Bulk import products, sales or incoming orders from a CSV or NDJSON file ('-' reads stdin)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=importer.KINDS)
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=importer.FORMATS, help="Default: from the file extension")
+        parser.add_argument('--user', help="Username that owns imported sales and incoming orders")
+        parser.add_argument('--chunk-size', type=int, default=importer.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        kind, path = options['kind'], options['path']
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"No user named {options['user']!r}")
+        try:
+            fmt = importer.detect_format(path, options['format'])
+            run = importer.Importer(kind, user=user, chunk_size=options['chunk_size'])
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        if path == '-':
+            report = run.run(sys.stdin, fmt)
+        else:
+            with open(path, 'rb') as data:
+                try:
+                    importer.check_utf8(iter(lambda: data.read(1 << 20), b''))
+                except ValueError as exc:
+                    raise CommandError(exc)
+            with open(path, newline='', encoding='utf-8-sig') as lines:
+                report = run.run(lines, fmt)
+
+        for error in report['error_rows']:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        message = (
+            f"Imported {report['rows']} {kind} rows in {report['seconds']}s "
+            f"({report['rows_per_second'] or 0} rows/s)"
+        )
+        if report['errors']:
+            self.stdout.write(self.style.WARNING(f"{message}; skipped {report['errors']} bad rows"))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from jobs import ocr
+
+
+class Command(BaseCommand):
+    help = "Run the OCR workers that answer queued OCR jobs in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.OCR_WORKERS,
+                            help="Worker threads, i.e. backend calls in flight at once")
+        parser.add_argument('--batch-size', type=int, default=settings.OCR_BATCH_SIZE)
+        parser.add_argument('--idle-seconds', type=float, default=1,
+                            help="How long a worker waits before checking an empty queue again")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        if not options['once']:
+            self.stdout.write(f"Running {concurrency} OCR workers")
+        ocr.run(concurrency, max(1, options['batch_size']), options['idle_seconds'], once=options['once'])
+        if options['once']:
+            self.stdout.write(self.style.SUCCESS("OCR queue is empty"))
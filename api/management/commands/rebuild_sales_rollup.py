@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from api.models import DailySalesRollup, Sales
+
+
+class Command(BaseCommand):
+    help = "Rebuild the DailySalesRollup table from the Sales history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        totals = (
+            Sales.objects.order_by()
+            .values_list('user_id', 'product_id', 'sale_date')
+            .annotate(total=Sum('quantity'))
+        )
+        created = 0
+        with transaction.atomic():
+            DailySalesRollup.objects.all().delete()
+            batch = []
+            for user_id, product_id, sale_date, total in totals.iterator(chunk_size=batch_size):
+                batch.append(DailySalesRollup(
+                    user_id=user_id, product_id=product_id, date=sale_date, qty=total
+                ))
+                if len(batch) >= batch_size:
+                    DailySalesRollup.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            DailySalesRollup.objects.bulk_create(batch)
+            created += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {created} daily sales rollup rows"))
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from jobs import updater
+
+
+class Command(BaseCommand):
+    help = "Run the inventory projection job; only the runner holding the lease does work"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run a single pass and exit")
+
+    def handle(self, *args, **options):
+        if not options['once']:
+            self.stdout.write(f"Running projections every {settings.PROJECTION_INTERVAL}s")
+            updater.start()
+            return
+        if updater.run_once():
+            self.stdout.write(self.style.SUCCESS("Projection run finished"))
+        else:
+            self.stdout.write("Another runner holds the projection lease")
@@ -0,0 +1,138 @@
+from datetime import timedelta
+
+from django.db.models import Value
+from django.utils.dateparse import parse_date
+
+from jobs.projection import HORIZON, WINDOW
+
+from .models import (
+    DailyInventoryMetrics, DailySalesRollup, OldIncomingInventory, OldUserInventory,
+)
+
+SERIES = [
+    'sales', 'on_hand', 'incoming', 'forecast', 'order_point',
+    'projected_on_hand', 'soq', 'planned_arrival',
+]
+MAX_DAYS = 366
+MAX_PRODUCTS = 1000
+
+
+def _param_date(params, name, default):
+    value = params.get(name)
+    if not value:
+        return default
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValueError(f"{name} must be a valid YYYY-MM-DD date")
+    return day
+
+
+def date_range(params, today, history=WINDOW):
+    """The start/end query params, defaulting to `history` days back through the forecast horizon."""
+    start = _param_date(params, 'start', today - timedelta(days=history))
+    end = _param_date(params, 'end', today + timedelta(days=HORIZON))
+    if start > end:
+        raise ValueError("start must not be after end")
+    if (end - start).days > MAX_DAYS:
+        raise ValueError(f"date range is limited to {MAX_DAYS} days")
+    return start, end
+
+
+def product_ids(params):
+    """Product ids from a list (JSON body or repeated param) or a comma-separated string."""
+    if hasattr(params, 'getlist'):
+        values = params.getlist('product_ids')
+    else:
+        values = params.get('product_ids') or []
+        if not isinstance(values, list):
+            values = [values]
+    ids = []
+    for value in values:
+        for part in str(value).split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if not part.isdigit():
+                raise ValueError("product_ids must be integers")
+            if int(part) not in ids:
+                ids.append(int(part))
+    if not ids:
+        raise ValueError("Missing required parameter product_ids")
+    if len(ids) > MAX_PRODUCTS:
+        raise ValueError(f"at most {MAX_PRODUCTS} product_ids per request")
+    return ids
+
+
+def history_rows(user_id, product_id, start, end):
+    """Sales, on-hand and receipts for the range as one UNION query of (series, date, quantity)"""
+    sales = DailySalesRollup.objects.filter(
+        user_id=user_id, product_id=product_id, date__range=(start, end)
+    ).annotate(series=Value('sales')).values_list('series', 'date', 'qty')
+    on_hand = OldUserInventory.objects.filter(
+        user_id=user_id, product_id=product_id, date__range=(start, end)
+    ).annotate(series=Value('on_hand')).values_list('series', 'date', 'quantity')
+    incoming = OldIncomingInventory.objects.filter(
+        user_id=user_id, product_id=product_id, arrival_date__range=(start, end)
+    ).annotate(series=Value('incoming')).values_list('series', 'arrival_date', 'quantity')
+    return sales.union(on_hand, incoming, all=True)
+
+
+def metrics_series(user_id, product_id, start, end, today):
+    """Column-wise metrics for each date from start to end.
+
+    History tables fill sales, on-hand and incoming up to today; stored
+    metrics rows fill everything else. Dates without data are null.
+    """
+    dates = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    position = {day: i for i, day in enumerate(dates)}
+    columns = {name: [None] * len(dates) for name in SERIES}
+    lead_time = None
+
+    stored = DailyInventoryMetrics.objects.filter(
+        user_id=user_id, product_id=product_id, date__range=(start, end)
+    ).values_list('date', 'is_projection', 'lead_time_days', *SERIES)
+    filled = {}
+    for day, is_projection, lead_time_days, *values in stored:
+        # A projection wins over an actuals row for the same date.
+        if filled.get(day):
+            continue
+        filled[day] = is_projection
+        lead_time = lead_time_days
+        for name, value in zip(SERIES, values):
+            columns[name][position[day]] = float(value)
+
+    for name, day, quantity in history_rows(user_id, product_id, start, min(end, today)):
+        columns[name][position[day]] = float(quantity)
+
+    return {
+        'dates': [day.isoformat() for day in dates],
+        'lead_time': lead_time,
+        **columns,
+    }
+
+
+def soq_matrix(user_id, product_ids, start, end):
+    """SOQ for every product and date in one query; rows follow `product_ids`, misses are null."""
+    dates = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    row = {product_id: i for i, product_id in enumerate(product_ids)}
+    column = {day: i for i, day in enumerate(dates)}
+    soq = [[None] * len(dates) for _ in product_ids]
+    stored = DailyInventoryMetrics.objects.filter(
+        user_id=user_id, product_id__in=product_ids, date__range=(start, end)
+    ).values_list('product_id', 'date', 'is_projection', 'soq')
+    projected = set()
+    for product_id, day, is_projection, value in stored:
+        # A projection wins over an actuals row for the same date.
+        if (product_id, day) in projected:
+            continue
+        if is_projection:
+            projected.add((product_id, day))
+        soq[row[product_id]][column[day]] = float(value)
+    return {
+        'product_ids': product_ids,
+        'dates': [day.isoformat() for day in dates],
+        'soq': soq,
+    }
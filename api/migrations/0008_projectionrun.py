@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-17 20:33
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_runnerlease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectionRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(default='running', max_length=20)),
+                ('stages', models.JSONField(blank=True, default=dict)),
+                ('profile_path', models.CharField(blank=True, max_length=255)),
+            ],
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2 on 2026-10-17 20:34
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_projectionrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectionrun',
+            name='full_sweep',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='projectionrun',
+            name='heartbeat',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='projectionrun',
+            name='last_change',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='projectionrun',
+            name='run_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='projectionrun',
+            name='watermark',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='projectionrun',
+            name='status',
+            field=models.CharField(choices=[('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('abandoned', 'Abandoned')], default='running', max_length=20),
+        ),
+    ]
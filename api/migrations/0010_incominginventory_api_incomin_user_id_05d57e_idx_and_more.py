@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-17 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_projectionrun_full_sweep_projectionrun_heartbeat_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='incominginventory',
+            index=models.Index(fields=['user', 'arrival_date', 'id'], name='api_incomin_user_id_05d57e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sales',
+            index=models.Index(fields=['user', 'timestamp', 'id'], name='api_sales_user_id_d47c30_idx'),
+        ),
+    ]
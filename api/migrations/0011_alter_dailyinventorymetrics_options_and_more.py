@@ -0,0 +1,45 @@
+# Generated by Django 5.2 on 2026-10-17 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_incominginventory_api_incomin_user_id_05d57e_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='dailyinventorymetrics',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='dailyinventorymetrics',
+            index=models.Index(fields=['user', 'date'], name='api_dailyin_user_id_596c38_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dailysalesrollup',
+            index=models.Index(fields=['user', 'date'], name='api_dailysa_user_id_a5477a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incominginventory',
+            index=models.Index(fields=['arrival_date'], name='api_incomin_arrival_943141_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='oldincominginventory',
+            index=models.Index(fields=['user', 'arrival_date'], name='api_oldinco_user_id_26dfb7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='olduserinventory',
+            index=models.Index(fields=['user', 'date'], name='api_olduser_user_id_3d12fa_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectionrun',
+            index=models.Index(fields=['run_date'], name='api_project_run_dat_5ec47a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sales',
+            index=models.Index(fields=['user', 'product', 'sale_date'], name='api_sales_user_id_0e0198_idx'),
+        ),
+    ]
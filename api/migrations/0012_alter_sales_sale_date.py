@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-17 20:51
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_alter_dailyinventorymetrics_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sales',
+            name='sale_date',
+            field=models.DateField(default=django.utils.timezone.localdate, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-17 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_ocrjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectionrun',
+            name='attempts',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-17 21:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_projectionrun_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectionrun',
+            name='done_shards',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
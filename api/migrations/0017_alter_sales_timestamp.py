@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-17 21:32
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_projectionrun_done_shards'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sales',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
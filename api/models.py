@@ -1,6 +1,14 @@
-from django.db import models
+import logging
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
+from . import projection_cache
+
+logger = logging.getLogger(__name__)
+
 
 class ImageUpload(models.Model):
     image = models.ImageField(upload_to='uploads/')
@@ -8,6 +16,42 @@ class ImageUpload(models.Model):
 
     def __str__(self):
         return f"Image uploaded at {self.uploaded_at}"
+
+class OcrResult(models.Model):
+    # SHA-256 of the image bytes and the OCR options (see api.ocr.cache_key)
+    key = models.CharField(max_length=64, unique=True)
+    feature = models.CharField(max_length=20)
+    result = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.feature} OCR result {self.key[:12]}"
+
+class OcrJob(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    user = models.ForeignKey('User', on_delete=models.CASCADE)
+    feature = models.CharField(max_length=20)
+    key = models.CharField(max_length=64)
+    # The image until the job finishes; emptied afterwards
+    content = models.BinaryField(blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'id'])]
+
+    def __str__(self):
+        return f"OCR job {self.id} ({self.status})"
 class User(AbstractUser):
     is_admin = models.BooleanField(default=False)
     
@@ -48,6 +92,7 @@ class OldUserInventory(models.Model):
     date = models.DateField()  
     class Meta:
         unique_together = ('user', 'product','date')
+        indexes = [models.Index(fields=['user', 'date'])]
     
     def __str__(self):
         return f"{self.user.username}'s {self.product.name}: {self.quantity} {self.date}"
@@ -70,18 +115,55 @@ class OldIncomingInventory(models.Model):
     
     class Meta:
         unique_together = ('user', 'product', 'arrival_date')
+        indexes = [models.Index(fields=['user', 'arrival_date'])]
     
     def __str__(self):
         return f"{self.product.name} arriving on {self.arrival_date}"
 
+def add_many(manager, key_fields, quantity_field, amounts):
+    """Add {key: quantity} to the `quantity_field` of rows with unique `key_fields`, creating missing rows.
+
+    Keys are tuples of values for `key_fields`, ids for foreign keys. One read
+    and one upsert; call inside a transaction that already holds the write lock.
+    """
+    if not amounts:
+        return
+    model = manager.model
+    names = [model._meta.get_field(field).attname for field in key_fields]
+    lookups = {f'{name}__in': {key[i] for key in amounts} for i, name in enumerate(names)}
+    current = {
+        tuple(row[:-1]): row[-1]
+        for row in manager.filter(**lookups).values_list(*names, quantity_field)
+    }
+    manager.bulk_create(
+        [
+            model(**dict(zip(names, key)), **{quantity_field: current.get(key, 0) + quantity})
+            for key, quantity in amounts.items()
+        ],
+        update_conflicts=True,
+        unique_fields=list(key_fields),
+        update_fields=[quantity_field],
+    )
+
+class IncomingInventoryManager(models.Manager):
+    def add_many(self, orders):
+        """Add {(user_id, product_id, arrival_date): quantity} to existing orders or create new ones."""
+        add_many(self, ['user', 'product', 'arrival_date'], 'quantity', orders)
+
 class IncomingInventory(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
     arrival_date = models.DateField()  # Calculated as order_date + lead_time
+
+    objects = IncomingInventoryManager()
     
     class Meta:
         unique_together = ('user', 'product', 'arrival_date')
+        indexes = [
+            models.Index(fields=['user', 'arrival_date', 'id']),
+            models.Index(fields=['arrival_date']),
+        ]
     
     def __str__(self):
         return f"{self.product.name} arriving on {self.arrival_date}"
@@ -90,12 +172,141 @@ class Sales(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
-    sale_date = models.DateField(auto_now_add=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Both default to now; imports of historical sales set them explicitly.
+    sale_date = models.DateField(default=timezone.localdate, editable=False)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'timestamp', 'id']),
+            models.Index(fields=['user', 'product', 'sale_date']),
+        ]
 
     def __str__(self):
         return f"{self.user.username} sold {self.quantity} {self.product.name}"
     
+class DailySalesRollupManager(models.Manager):
+    def add(self, user, product, date, quantity):
+        """Add `quantity` (negative to remove) to the (user, product, date) total"""
+        rows = self.filter(user=user, product=product, date=date)
+        if rows.update(qty=F('qty') + quantity):
+            return
+        if quantity < 0:
+            # Nothing to take the quantity from; creating a negative row would
+            # fail the CHECK constraint and be mistaken for a race below.
+            logger.warning(
+                "No sales rollup for user %s, product %s on %s to remove %s from; run rebuild_sales_rollup",
+                getattr(user, 'pk', user), getattr(product, 'pk', product), date, -quantity,
+            )
+            return
+        try:
+            with transaction.atomic():
+                self.create(user=user, product=product, date=date, qty=quantity)
+        except IntegrityError:
+            # Another writer created the row first
+            rows.update(qty=F('qty') + quantity)
+
+    def add_many(self, totals):
+        """Add {(user_id, product_id, date): quantity} to the totals, creating missing rows."""
+        add_many(self, ['user', 'product', 'date'], 'qty', totals)
+
+class DailySalesRollup(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    date = models.DateField()
+    qty = models.PositiveIntegerField(default=0)
+
+    objects = DailySalesRollupManager()
+
+    class Meta:
+        unique_together = ('user', 'product', 'date')
+        indexes = [models.Index(fields=['user', 'date'])]
+
+    def __str__(self):
+        return f"{self.user.username} sold {self.qty} {self.product.name} on {self.date}"
+    
+class ProjectionChangeManager(models.Manager):
+    def mark(self, pairs):
+        """Record that projections for these (user_id, product_id) pairs are stale
+
+        Cached reads for the users are dropped once the change commits, since
+        metrics include the sales and receipts that just changed.
+        """
+        pairs = set(pairs)
+        self.bulk_create(
+            [ProjectionChange(user_id=user_id, product_id=product_id) for user_id, product_id in pairs]
+        )
+        users = {user_id for user_id, _ in pairs}
+        if users:
+            transaction.on_commit(lambda: projection_cache.bump(users))
+
+    def pending(self, up_to=None):
+        """Return (last journal id, {user_id: set of product_ids}) for unprocessed changes"""
+        last_id = None
+        changed = {}
+        changes = self.order_by('id')
+        if up_to is not None:
+            changes = changes.filter(id__lte=up_to)
+        for change_id, user_id, product_id in changes.values_list('id', 'user_id', 'product_id'):
+            last_id = change_id
+            changed.setdefault(user_id, set()).add(product_id)
+        return last_id, changed
+
+class ProjectionChange(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ProjectionChangeManager()
+
+    def __str__(self):
+        return f"{self.user.username}'s {self.product.name} changed at {self.changed_at}"
+
+class ProjectionSweep(models.Model):
+    date = models.DateField(unique=True)
+    finished_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Full projection sweep for {self.date}"
+    
+class RunnerLease(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    holder = models.CharField(max_length=255)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder} until {self.expires_at}"
+    
+class ProjectionRun(models.Model):
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('abandoned', 'Abandoned'),
+    ]
+    run_date = models.DateField(null=True, blank=True)
+    full_sweep = models.BooleanField(default=False)
+    # Last ProjectionChange id the run covers, and last user id it committed
+    last_change = models.BigIntegerField(null=True, blank=True)
+    watermark = models.BigIntegerField(null=True, blank=True)
+    # [first, last] user ids of shards committed out of order (Celery runs)
+    done_shards = models.JSONField(default=list, blank=True)
+    started_at = models.DateTimeField(default=timezone.now)
+    heartbeat = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    # Times the run was started or resumed
+    attempts = models.PositiveIntegerField(default=1)
+    # {stage: {"seconds", "queries", "query_seconds", "rows"}}
+    stages = models.JSONField(default=dict, blank=True)
+    profile_path = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['run_date'])]
+
+    def __str__(self):
+        return f"Projection run {self.id} ({self.status}) started {self.started_at}"
+    
 class DailyInventoryMetrics(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -117,7 +328,7 @@ class DailyInventoryMetrics(models.Model):
 
     class Meta:
         unique_together = ('user', 'product', 'date', 'is_projection')
-        ordering = ['-date']
+        indexes = [models.Index(fields=['user', 'date'])]
 
     def __str__(self):
         type_flag = "PROJ" if self.is_projection else "ACTUAL"
@@ -0,0 +1,198 @@
+"""OCR through a pluggable backend, with results cached by image content.
+
+Results are stored in OcrResult under the SHA-256 of the image bytes and the
+request options, so a label that is scanned again is answered from the table
+without calling the backend. Backends are process-wide singletons chosen by
+the OCR_BACKEND setting: VisionBackend keeps a small pool of Vision clients
+(each one gRPC channel with its TLS session and loaded credentials) for the
+life of the process instead of building one per request, and FakeBackend
+reads image bytes as UTF-8 text for tests and local runs without credentials.
+
+submit() queues an image as an OcrJob instead; the workers in jobs.ocr
+answer pending jobs a batch at a time.
+
+A result is a JSON-ready dict: {"text": ...} for the 'text' feature,
+{"words": [{"text", "confidence", "bounds"}, ...]} in reading order for
+'document', or {"error": message}, which is never cached.
+"""
+import hashlib
+import itertools
+import json
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OcrJob, OcrResult
+
+FEATURES = {
+    'text': {},
+    'document': {'language_hints': ['en'], 'confidence': True},
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def cache_key(content, feature):
+    digest = hashlib.sha256(content)
+    digest.update(json.dumps([feature, FEATURES[feature]], sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def get_backend():
+    """The process-wide instance of settings.OCR_BACKEND."""
+    path = getattr(settings, 'OCR_BACKEND', 'api.ocr.VisionBackend')
+    backend = _backends.get(path)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(path)
+            if backend is None:
+                backend = _backends[path] = import_string(path)()
+    return backend
+
+
+def _words_in_reading_order(words):
+    # Top to bottom, then left to right, by each word's first vertex.
+    return sorted(words, key=lambda word: (word['bounds'][0][1], word['bounds'][0][0]) if word['bounds'] else (0, 0))
+
+
+class VisionBackend:
+    """Google Cloud Vision, with clients shared by every request in the process."""
+
+    # Images per batch_annotate_images call allowed by the API
+    MAX_BATCH = 16
+
+    def __init__(self, pool_size=None):
+        self.pool_size = max(1, pool_size or getattr(settings, 'OCR_CLIENT_POOL_SIZE', 2))
+        self._clients = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        if self._clients is None:
+            with self._lock:
+                if self._clients is None:
+                    from google.cloud import vision
+                    clients = [vision.ImageAnnotatorClient() for _ in range(self.pool_size)]
+                    self._clients = itertools.cycle(clients)
+        with self._lock:
+            return next(self._clients)
+
+    def request(self, content, feature):
+        from google.cloud import vision
+        options = FEATURES[feature]
+        if feature == 'document':
+            return vision.AnnotateImageRequest(
+                image=vision.Image(content=content),
+                features=[vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)],
+                image_context=vision.ImageContext(
+                    language_hints=options['language_hints'],
+                    text_detection_params=vision.TextDetectionParams(
+                        enable_text_detection_confidence_score=options['confidence']
+                    ),
+                ),
+            )
+        return vision.AnnotateImageRequest(
+            image=vision.Image(content=content),
+            features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)],
+        )
+
+    def result(self, response, feature):
+        if response.error.message:
+            return {'error': response.error.message}
+        if feature == 'text':
+            texts = response.text_annotations
+            return {'text': texts[0].description if texts else ''}
+        words = []
+        for page in response.full_text_annotation.pages:
+            for block in page.blocks:
+                for paragraph in block.paragraphs:
+                    for word in paragraph.words:
+                        words.append({
+                            'text': ''.join(symbol.text for symbol in word.symbols),
+                            'confidence': word.confidence,
+                            'bounds': [[vertex.x, vertex.y] for vertex in word.bounding_box.vertices],
+                        })
+        return {'words': _words_in_reading_order(words)}
+
+    def annotate(self, images):
+        """Results for a list of (content, feature) pairs, one batch call per MAX_BATCH images."""
+        results = []
+        for start in range(0, len(images), self.MAX_BATCH):
+            batch = images[start:start + self.MAX_BATCH]
+            response = self.client().batch_annotate_images(
+                requests=[self.request(content, feature) for content, feature in batch]
+            )
+            results.extend(self.result(each, feature) for each, (_, feature) in zip(response.responses, batch))
+        return results
+
+
+class FakeBackend:
+    """Reads image bytes as UTF-8 text: one word per whitespace-separated token, one row per line."""
+
+    def __init__(self):
+        self.calls = 0
+        self.images = 0
+        self._lock = threading.Lock()
+
+    def annotate(self, images):
+        with self._lock:
+            self.calls += 1
+            self.images += len(images)
+        return [self.result(content, feature) for content, feature in images]
+
+    def result(self, content, feature):
+        text = content.decode('utf-8', errors='replace')
+        if text.startswith('error:'):
+            return {'error': text[len('error:'):].strip()}
+        if feature == 'text':
+            return {'text': text}
+        words = []
+        for row, line in enumerate(text.splitlines()):
+            for column, token in enumerate(line.split()):
+                x, y = column * 100, row * 20
+                words.append({
+                    'text': token,
+                    'confidence': 1.0,
+                    'bounds': [[x, y], [x + 90, y], [x + 90, y + 15], [x, y + 15]],
+                })
+        return {'words': _words_in_reading_order(words)}
+
+
+def cached(keys):
+    """{key: result} for the keys that have a stored result."""
+    return dict(OcrResult.objects.filter(key__in=set(keys)).values_list('key', 'result'))
+
+
+def store(results):
+    """Cache {key: (feature, result)}, skipping errors and keys already stored."""
+    OcrResult.objects.bulk_create(
+        [
+            OcrResult(key=key, feature=feature, result=result)
+            for key, (feature, result) in results.items() if 'error' not in result
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def annotate(content, feature):
+    """The OCR result for one image, from the cache when these bytes were seen before."""
+    key = cache_key(content, feature)
+    result = cached([key]).get(key)
+    if result is None:
+        result = get_backend().annotate([(content, feature)])[0]
+        store({key: (feature, result)})
+    return result
+
+
+def submit(user, content, feature):
+    """Queue an image for the OCR workers; a cached image's job is done at once."""
+    key = cache_key(content, feature)
+    result = cached([key]).get(key)
+    if result is not None:
+        now = timezone.now()
+        return OcrJob.objects.create(
+            user=user, feature=feature, key=key, status='done', result=result, started_at=now, finished_at=now,
+        )
+    return OcrJob.objects.create(user=user, feature=feature, key=key, content=content)
@@ -0,0 +1,97 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination on (ordering field, id).
+
+    The cursor holds the last row's (value, id), and the next page starts
+    with an index range seek past it, so a page costs the same however
+    deep the client scrolls. Only forward paging is supported.
+    """
+    ordering = '-id'
+    page_size = 100
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.field = self.ordering.lstrip('-')
+        descending = self.ordering.startswith('-')
+        size = self.get_page_size(request)
+
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            value, pk = position
+            before, past = ('lte', 'lt') if descending else ('gte', 'gt')
+            # The first filter bounds the index range; the second drops ties already served.
+            queryset = queryset.filter(**{f'{self.field}__{before}': value}).filter(
+                Q(**{f'{self.field}__{past}': value}) | Q(**{f'pk__{past}': pk})
+            )
+        order = ('-' if descending else '') + 'pk'
+        rows = list(queryset.order_by(self.ordering, order)[:size + 1])
+        self.next_position = None
+        if len(rows) > size:
+            rows = rows[:size]
+            last = rows[-1]
+            if isinstance(last, dict):
+                # Rows from .values()
+                self.next_position = (last[self.field], last[queryset.model._meta.pk.attname])
+            else:
+                self.next_position = (getattr(last, self.field), last.pk)
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            return model._meta.get_field(self.field).to_python(value), int(pk)
+        except (TypeError, ValueError, DjangoValidationError):
+            raise ValidationError({self.cursor_query_param: [self.invalid_cursor_message]})
+
+    def encode_cursor(self, position):
+        value, pk = position
+        encoded = base64.urlsafe_b64encode(json.dumps([value.isoformat(), pk]).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.encode_cursor(self.next_position) if self.next_position else None,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class SalesPagination(KeysetPagination):
+    ordering = '-timestamp'
+
+
+class IncomingInventoryPagination(KeysetPagination):
+    ordering = 'arrival_date'
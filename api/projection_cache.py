@@ -0,0 +1,81 @@
+"""Read-through cache for projection reads (SOQ and metrics).
+
+Keys carry a per-user projection version. The job's MetricsWriter bumps the
+versions of the users it wrote once their rows commit, and so does every
+sale, purchase or delivery through ProjectionChange.objects.mark, which
+orphans every cached read for those users in one write. Versions are seeded with
+time.time_ns(), so a cache that lost its version keys never reuses an old one.
+
+The "projections" cache alias is file based by default so the web and job
+processes share it.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+ALIAS = 'projections'
+COUNTERS = ('hits', 'misses')
+
+
+def _cache():
+    return caches[ALIAS]
+
+
+def _version_key(user_id):
+    return f"projection-version:{user_id}"
+
+
+def version(user_id):
+    cache = _cache()
+    key = _version_key(user_id)
+    current = cache.get(key)
+    if current is None:
+        cache.add(key, time.time_ns(), None)
+        current = cache.get(key)
+    return current
+
+
+def bump(user_ids):
+    """Invalidate every cached read for `user_ids`."""
+    now = time.time_ns()
+    _cache().set_many({_version_key(user_id): now for user_id in user_ids}, None)
+
+
+def key(user_id, name, *parts):
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f"projection:{name}:{user_id}:{version(user_id)}:{digest}"
+
+
+def _count(counter):
+    cache = _cache()
+    name = f"projection-cache:{counter}"
+    cache.add(name, 0, None)
+    try:
+        cache.incr(name)
+    except ValueError:
+        # Evicted between add and incr.
+        cache.set(name, 1, None)
+
+
+def get_or_compute(cache_key, compute):
+    """The cached value for `cache_key`, computing and storing it on a miss. None is not cached."""
+    cache = _cache()
+    value = cache.get(cache_key)
+    if value is not None:
+        _count('hits')
+        return value
+    _count('misses')
+    value = compute()
+    if value is not None:
+        cache.set(cache_key, value, settings.PROJECTION_CACHE_SECONDS)
+    return value
+
+
+def stats():
+    values = _cache().get_many([f"projection-cache:{counter}" for counter in COUNTERS])
+    counts = {counter: values.get(f"projection-cache:{counter}", 0) for counter in COUNTERS}
+    total = counts['hits'] + counts['misses']
+    counts['hit_rate'] = round(counts['hits'] / total, 4) if total else None
+    return counts
@@ -4,9 +4,10 @@ from django.contrib.auth import get_user_model
 from .models import Category, Product, UserInventory, Sales, IncomingInventory,DailyInventoryMetrics
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 import base64
+import binascii
 
 User = get_user_model()  # Ensures we use the custom User model
-from .models import ImageUpload
+from .models import ImageUpload, OcrJob
 class DailyInventoryMetricsSerializer(serializers.ModelSerializer):
     class Meta:
         model = DailyInventoryMetrics
@@ -30,6 +31,34 @@ class ImageProcessingSerializer(serializers.Serializer):
         except:
             raise serializers.ValidationError("Invalid base64 image data")
 
+class OcrJobSubmitSerializer(serializers.Serializer):
+    """An image as base64 `image` (JSON) or an uploaded `file` (multipart)."""
+    image = serializers.CharField(required=False)
+    file = serializers.FileField(required=False)
+    feature = serializers.ChoiceField(choices=['document', 'text'], default='document')
+
+    def validate(self, data):
+        if ('image' in data) == ('file' in data):
+            raise serializers.ValidationError("Send either a base64 image or an uploaded file")
+        if 'file' in data:
+            data['content'] = data.pop('file').read()
+        else:
+            value = data.pop('image')
+            if ',' in value:
+                value = value.split(',')[1]
+            try:
+                data['content'] = base64.b64decode(value, validate=True)
+            except (binascii.Error, ValueError):
+                raise serializers.ValidationError({'image': "Invalid base64 image data"})
+        if not data['content']:
+            raise serializers.ValidationError("The image is empty")
+        return data
+
+class OcrJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OcrJob
+        fields = ('id', 'feature', 'status', 'result', 'error', 'created_at', 'finished_at')
+
 class BuyProductSerializer(serializers.Serializer):
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(),
@@ -43,6 +72,13 @@ class SellProductSerializer(serializers.Serializer):
         source='product'
     )
     quantity = serializers.IntegerField(min_value=1)
+class OrderLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+
+class OrderBatchSerializer(serializers.Serializer):
+    # Plain ids: products are resolved for the whole batch with one in_bulk query
+    lines = OrderLineSerializer(many=True, allow_empty=False, max_length=1000)
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
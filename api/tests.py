@@ -1,3 +1,1391 @@
-from django.test import TestCase
+import base64
+import json
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from jobs import jobs, leader, ledger, projection, tasks, updater
+from jobs.writer import MetricsWriter
+from jobs import ocr as ocr_jobs
+
+from . import export, importer, ocr, projection_cache
+
+from .models import (
+    Category, DailyInventoryMetrics, DailySalesRollup, ProjectionRun, ProjectionSweep, IncomingInventory, OldIncomingInventory,
+    OcrJob, OcrResult, OldUserInventory, Product, ProjectionChange, RunnerLease, Sales, User, UserInventory,
+)
+from .serializers import IncomingInventorySerializer, InventorySerializer, ProductSerializer, SalesSerializer
+from .values import reader_for
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'projections': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'},
+}
+
+
+
+# The per-day helpers predict_next used before projection.project, kept as the
+# reference it must match. Only their debug prints are gone, and the current
+# date is passed in instead of read from the clock.
+
+def get_projectedOnhand(po, main_data, fc, inc, to_date, product, hist, lead, current_date):
+    date_obj = datetime.strptime(to_date, "%Y-%m-%d").date()
+    previous_day = date_obj - timedelta(days=1)
+    if previous_day == current_date:
+        if po:
+            return main_data[product]['onhand'][str(previous_day)] - fc + inc + 0
+        else:
+            return 0
+    else:
+        x = date_obj - timedelta(days=lead)
+        arriaval = 0
+        if x in hist:
+            arriaval = hist[x][1]
+        if po:
+            return hist[str(previous_day)][0] - fc + inc + arriaval
+        else:
+            return arriaval
+
+
+def get_soq(poh, op):
+    if poh < op:
+        return op - poh
+    else:
+        return 0
+
+
+def calculate_forecast(product, date, main_data, next_days):
+    all_data = []
+    for i in main_data[product]["sales"].keys():
+        all_data.append(main_data[product]["sales"][i])
+    for i in next_days:
+        vel = sum(all_data[:7]) / 7
+        all_data.insert(0, vel)
+        if i == date:
+            return round(vel, 2)
+
+
+def get_orderPoint(product, date, main_data, lead_time, current_date):
+    next_x_days = [(current_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(1, 15 + lead_time)]
+    all_data = []
+    all_date = []
+    for i in main_data[product]["sales"].keys():
+        all_data.append(main_data[product]["sales"][i])
+        all_date.append(i)
+    for i in next_x_days:
+        vel = sum(all_data[:7]) / 7
+        all_data.insert(0, vel)
+        all_date.insert(0, i)
+    x = all_date.index(date)
+    total_point = 0
+    for i in range(lead_time):
+        total_point += all_data[x]
+        x -= 1
+    return round(total_point, 2)
+
+
+def reference_projection(main_data, incoming, current_date):
+    """The old predict_next loop; `incoming` maps (product, date string) to receipts."""
+    next_14_days = [(current_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(1, 15)]
+    rows = {}
+    for product in main_data:
+        hist = {}
+        lead = main_data[product]['lead']
+        for dt in next_14_days:
+            fc = calculate_forecast(product, dt, main_data, next_14_days)
+            inc = incoming.get((product, dt), 0)
+            op = get_orderPoint(product, dt, main_data, lead, current_date)
+            poh = get_projectedOnhand(True, main_data, fc, inc, dt, product, hist, lead, current_date)
+            soq = get_soq(poh, op)
+            planned = get_projectedOnhand(False, main_data, fc, inc, dt, product, hist, lead, current_date)
+            hist[dt] = [poh, soq]
+            rows[product, dt] = (fc, op, poh, soq, planned)
+    return rows
+
+
+class ProjectionEquivalenceTests(SimpleTestCase):
+    """projection.project must give the same numbers as the per-day reference helpers."""
+
+    TRIALS = 300
+
+    def test_matches_reference(self):
+        rnd = random.Random(0)
+        current_date = date(2026, 3, 14)
+        history = [(current_date - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7)]
+        next_days = [(current_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(1, 15)]
+        for trial in range(self.TRIALS):
+            products = range(rnd.randint(1, 6))
+            main_data = {
+                product: {
+                    'sales': {day: rnd.choice([0, 0, rnd.randint(0, 40)]) for day in history},
+                    'onhand': {history[0]: rnd.randint(0, 300)},
+                    'lead': rnd.randint(0, 12),
+                }
+                for product in products
+            }
+            incoming = {
+                (product, day): rnd.randint(1, 80)
+                for product in products for day in next_days if rnd.random() < 0.15
+            }
+            expected = reference_projection(main_data, incoming, current_date)
+            result = projection.project(
+                [list(main_data[p]['sales'].values()) for p in products],
+                [main_data[p]['onhand'][history[0]] for p in products],
+                [[incoming.get((p, day), 0) for day in next_days] for p in products],
+                [main_data[p]['lead'] for p in products],
+            )
+            for p in products:
+                for col, day in enumerate(next_days):
+                    actual = tuple(
+                        float(result[name][p, col])
+                        for name in ('forecast', 'order_point', 'projected_on_hand', 'soq', 'planned_arrival')
+                    )
+                    self.assertEqual(actual, expected[p, day], f"trial {trial}, product {p}, {day}")
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite specific")
+@override_settings(CACHES=LOCMEM_CACHES)
+class QueryPlanTests(TestCase):
+    """The hot queries must search an index: no full table scans and no temp B-tree sorts."""
+
+    USERS = 4
+    PRODUCTS = 12
+    DAYS = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        category = Category.objects.create(name='Plan')
+        cls.users = [User.objects.create_user(username=f'plan{i}', password='x') for i in range(cls.USERS)]
+        cls.products = Product.objects.bulk_create([
+            Product(product_number=f'PLAN{i}', name=f'Plan {i}', category=category, lead_time=i % 5)
+            for i in range(cls.PRODUCTS)
+        ])
+        pairs = [(user, product) for user in cls.users for product in cls.products]
+        days = [today - timedelta(days=i) for i in range(cls.DAYS)]
+        UserInventory.objects.bulk_create([UserInventory(user=u, product=p, quantity=50) for u, p in pairs])
+        OldUserInventory.objects.bulk_create([
+            OldUserInventory(user=u, product=p, quantity=50, date=day) for u, p in pairs for day in days
+        ])
+        OldIncomingInventory.objects.bulk_create([
+            OldIncomingInventory(user=u, product=p, quantity=5, arrival_date=day) for u, p in pairs for day in days[::7]
+        ])
+        IncomingInventory.objects.bulk_create([
+            IncomingInventory(user=u, product=p, quantity=5, arrival_date=today + timedelta(days=offset))
+            for u, p in pairs for offset in (-1, 3, 9)
+        ])
+        Sales.objects.bulk_create([Sales(user=u, product=p, quantity=2) for u, p in pairs for _ in range(3)])
+        DailySalesRollup.objects.bulk_create([
+            DailySalesRollup(user=u, product=p, date=day, qty=2) for u, p in pairs for day in days
+        ])
+        DailyInventoryMetrics.objects.bulk_create([
+            DailyInventoryMetrics(
+                user=u, product=p, date=today + timedelta(days=offset), is_projection=True,
+                sales=0, on_hand=10, incoming=0, order_point=5, lead_time_days=p.lead_time,
+                forecast=2, projected_on_hand=8, soq=1, planned_arrival=0,
+            )
+            for u, p in pairs for offset in range(1, 15)
+        ])
+
+    def setUp(self):
+        caches['projections'].clear()
+        self.user = self.users[1]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertIndexed(self, sql, params=(), seek=None):
+        """Fail on scans and temp B-trees; with `seek`, also require that index constraint."""
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        for step in plan:
+            self.assertFalse(
+                step.startswith('SCAN') or 'TEMP B-TREE' in step,
+                f"{step!r} in the plan for:\n{sql}",
+            )
+        if seek:
+            self.assertTrue(any(seek in step for step in plan), f"no {seek!r} seek in {plan} for:\n{sql}")
+
+    def assertQueriesIndexed(self, call):
+        with CaptureQueriesContext(connection) as captured:
+            result = call()
+        statements = [
+            query['sql'] for query in captured.captured_queries
+            if query['sql'].startswith(('SELECT', 'UPDATE', 'DELETE'))
+        ]
+        self.assertTrue(statements)
+        for sql in statements:
+            self.assertIndexed(sql)
+        return result
+
+    def test_sales_list_pages(self):
+        page = self.assertQueriesIndexed(lambda: self.client.get('/api/sales/?page_size=10'))
+        self.assertQueriesIndexed(lambda: self.client.get(page.data['next']))
+        today = timezone.localdate().isoformat()
+        self.assertQueriesIndexed(lambda: self.client.get(f'/api/sales/?start={today}&end={today}'))
+
+    def test_incoming_list_pages(self):
+        page = self.assertQueriesIndexed(lambda: self.client.get('/api/incoming/?page_size=10'))
+        self.assertQueriesIndexed(lambda: self.client.get(page.data['next']))
+        today = timezone.localdate().isoformat()
+        self.assertQueriesIndexed(lambda: self.client.get(f'/api/incoming/?start={today}'))
+
+    def test_metrics_reads(self):
+        product = self.products[3]
+        day = (timezone.localdate() + timedelta(days=2)).isoformat()
+        ids = ','.join(str(p.id) for p in self.products[:5])
+        self.assertQueriesIndexed(lambda: self.client.get(f'/api/metrics/{product.id}/'))
+        self.assertQueriesIndexed(lambda: self.client.get(f'/api/get-soq/?product_id={product.id}&date={day}'))
+        self.assertQueriesIndexed(lambda: self.client.get(f'/api/get-soq/batch/?product_ids={ids}'))
+
+    def test_metrics_range_by_user(self):
+        today = timezone.localdate()
+        queryset = DailyInventoryMetrics.objects.filter(user=self.user, date__range=(today, today + timedelta(days=14)))
+        self.assertIndexed(*queryset.query.sql_with_params(), seek='user_id=? AND date>? AND date<?')
+
+    def test_history_windows_by_user(self):
+        # The shard loader reads a few days of history for a list of users.
+        today = timezone.localdate()
+        window = (today - timedelta(days=6), today)
+        user_ids = [user.id for user in self.users[:2]]
+        for queryset, field in (
+            (OldUserInventory.objects, 'date'),
+            (DailySalesRollup.objects, 'date'),
+            (OldIncomingInventory.objects, 'arrival_date'),
+        ):
+            queryset = queryset.filter(user_id__in=user_ids, **{field + '__range': window})
+            self.assertIndexed(*queryset.query.sql_with_params(), seek=f'user_id=? AND {field}>? AND {field}<?')
+
+    def test_receive_arrivals(self):
+        received = self.assertQueriesIndexed(jobs.update_incoming)
+        self.assertEqual(received, self.USERS * self.PRODUCTS)
+
+    def test_shard_load(self):
+        today = timezone.localdate()
+        changed = {self.user.id: {self.products[0].id, self.products[5].id}}
+        rows = self.assertQueriesIndexed(lambda: jobs.project_users([self.user.id], today, changed))
+        self.assertTrue(rows)
+
+    def test_run_ledger_lookups(self):
+        today = timezone.localdate()
+        self.assertQueriesIndexed(lambda: ledger.live_run(today))
+        self.assertQueriesIndexed(lambda: ledger.resumable_run(today))
+
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MetricsETagTests(TestCase):
+    """Dashboards polling /api/metrics/ get 304s until a projection run lands."""
+
+    def setUp(self):
+        caches['projections'].clear()
+        category = Category.objects.create(name='ETag')
+        self.product = Product.objects.create(product_number='E1', name='ETag 1', category=category, lead_time=3)
+        self.user = User.objects.create_user(username='poller', password='x')
+        UserInventory.objects.create(user=self.user, product=self.product, quantity=10)
+        self.today = timezone.localdate()
+        DailySalesRollup.objects.create(user=self.user, product=self.product, date=self.today, qty=14)
+        with self.captureOnCommitCallbacks(execute=True):
+            write_projections([self.user.id], self.today)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/metrics/{self.product.id}/'
+
+    def test_matching_etag_is_not_modified(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+        cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], etag)
+        self.assertFalse(cached.content)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_etag_changes_after_a_run(self):
+        etag = self.client.get(self.url)['ETag']
+        DailySalesRollup.objects.filter(user=self.user).update(qty=28)
+        with self.captureOnCommitCallbacks(execute=True):
+            write_projections([self.user.id], self.today)
+        fresh = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(fresh.status_code, 200)
+        self.assertNotEqual(fresh['ETag'], etag)
+        tomorrow = fresh.data['metrics']['dates'].index((self.today + timedelta(days=1)).isoformat())
+        self.assertEqual(fresh.data['metrics']['forecast'][tomorrow], 4)
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BatchSOQTests(TestCase):
+    URL = '/api/get-soq/batch/'
+
+    def setUp(self):
+        caches['projections'].clear()
+        category = Category.objects.create(name='SOQ')
+        self.products = [
+            Product.objects.create(product_number=f'SOQ{i}', name=f'SOQ {i}', category=category) for i in range(3)
+        ]
+        self.user = User.objects.create_user(username='soq', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.today = timezone.localdate()
+        self.days = [self.today + timedelta(days=i) for i in range(3)]
+        first, second, _ = self.products
+        self.metric(first, self.days[0], 4)
+        self.metric(first, self.days[2], 6)
+        # The projection wins over the actuals row for the same day.
+        self.metric(second, self.days[1], 7)
+        self.metric(second, self.days[1], 1, is_projection=False)
+        other = User.objects.create_user(username='soq-other', password='x')
+        self.metric(second, self.days[0], 99, user=other)
+
+    def metric(self, product, day, soq, is_projection=True, user=None):
+        DailyInventoryMetrics.objects.create(
+            user=user or self.user, product=product, date=day, is_projection=is_projection, lead_time_days=0,
+            order_point=0, forecast=0, projected_on_hand=0, soq=soq, planned_arrival=0,
+        )
+
+    def params(self):
+        first, second, third = self.products
+        return {
+            'product_ids': f'{third.id},{first.id},{second.id}',
+            'start': self.days[0].isoformat(), 'end': self.days[2].isoformat(),
+        }
+
+    def test_matrix(self):
+        first, second, third = self.products
+        response = self.client.get(self.URL, self.params())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            'product_ids': [third.id, first.id, second.id],
+            'dates': [day.isoformat() for day in self.days],
+            'soq': [[None, None, None], [4.0, None, 6.0], [None, 7.0, None]],
+        })
+
+        body = dict(self.params(), product_ids=[third.id, first.id, second.id])
+        posted = self.client.post(self.URL, body, format='json')
+        self.assertEqual(posted.status_code, 200)
+        self.assertEqual(posted.data, response.data)
+
+    def test_bad_requests(self):
+        first = self.products[0].id
+        for params in (
+            {},
+            {'product_ids': 'abc'},
+            {'product_ids': f'{first},-1'},
+            {'product_ids': first, 'start': '2024-02-30'},
+            {'product_ids': first, 'start': '2024-03-02', 'end': '2024-03-01'},
+            {'product_ids': first, 'start': '2024-01-01', 'end': '2025-06-01'},
+        ):
+            response = self.client.get(self.URL, params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.data)
+        for body in ({'product_ids': []}, {'product_ids': ['x']}, {'product_ids': [first], 'end': 'tomorrow'}):
+            self.assertEqual(self.client.post(self.URL, body, format='json').status_code, 400, body)
+
+    def test_query_count(self):
+        with self.assertNumQueries(1):
+            self.client.get(self.URL, self.params())
+        # Repeated reads are answered from the projection cache.
+        with self.assertNumQueries(0):
+            self.client.get(self.URL, self.params())
+        self.metric(self.products[2], self.days[1], 3)
+        projection_cache.bump([self.user.id])
+        with self.assertNumQueries(1):
+            response = self.client.get(self.URL, self.params())
+        self.assertEqual(response.data['soq'][0], [None, 3.0, None])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProjectionCacheInvalidationTests(TestCase):
+    """A projection run, a sale and a delivery each drop the user's cached projection reads."""
+
+    def setUp(self):
+        caches['projections'].clear()
+        category = Category.objects.create(name='Cache')
+        self.product = Product.objects.create(product_number='C1', name='Cache 1', category=category, lead_time=2)
+        self.user = User.objects.create_user(username='cached', password='x')
+        self.other = User.objects.create_user(username='bystander', password='x')
+        UserInventory.objects.create(user=self.user, product=self.product, quantity=50)
+        self.today = timezone.localdate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/metrics/{self.product.id}/?start={self.today}&end={self.today}'
+
+    def read(self):
+        return self.client.get(self.url).data['metrics']
+
+    def assertInvalidates(self, write):
+        self.read()
+        with self.assertNumQueries(0):
+            self.read()
+        version, other_version = projection_cache.version(self.user.id), projection_cache.version(self.other.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        self.assertNotEqual(projection_cache.version(self.user.id), version)
+        self.assertEqual(projection_cache.version(self.other.id), other_version)
+        return self.read()
+
+    def test_projection_run(self):
+        DailySalesRollup.objects.create(user=self.user, product=self.product, date=self.today, qty=7)
+        series = self.assertInvalidates(lambda: write_projections([self.user.id], self.today))
+        self.assertEqual(series['sales'], [7])
+
+    def test_sale(self):
+        series = self.assertInvalidates(
+            lambda: self.client.post('/api/sell/', {'product_id': self.product.id, 'quantity': 5}, format='json')
+        )
+        self.assertEqual(series['sales'], [5])
+
+    def test_delivery(self):
+        IncomingInventory.objects.create(user=self.user, product=self.product, quantity=8, arrival_date=self.today)
+        series = self.assertInvalidates(jobs.update_incoming)
+        self.assertEqual(series['incoming'], [8])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SellConcurrencyTests(TransactionTestCase):
+    """Many threads selling the same stock must never oversell or lose a decrement."""
+
+    THREADS = 8
+    SELLS_PER_THREAD = 15
+    STOCK = 70
+
+    def setUp(self):
+        category = Category.objects.create(name='Sell')
+        self.product = Product.objects.create(product_number='SELL1', name='Sell 1', category=category)
+        self.user = User.objects.create_user(username='seller', password='x')
+        UserInventory.objects.create(user=self.user, product=self.product, quantity=self.STOCK)
+
+    def sell_many(self, results):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        try:
+            for _ in range(self.SELLS_PER_THREAD):
+                response = client.post('/api/sell/', {'product_id': self.product.id, 'quantity': 1}, format='json')
+                results.append(response.status_code)
+        finally:
+            connection.close()
+
+    def test_concurrent_sells(self):
+        results = []
+        threads = [threading.Thread(target=self.sell_many, args=(results,)) for _ in range(self.THREADS)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        attempts = self.THREADS * self.SELLS_PER_THREAD
+        self.assertEqual(len(results), attempts)
+        self.assertEqual(results.count(201), self.STOCK)
+        self.assertEqual(results.count(400), attempts - self.STOCK)
+        self.assertEqual(UserInventory.objects.get(user=self.user, product=self.product).quantity, 0)
+        self.assertEqual(Sales.objects.filter(user=self.user, product=self.product).count(), self.STOCK)
+        self.assertEqual(DailySalesRollup.objects.get(user=self.user, product=self.product).qty, self.STOCK)
+        # Loose floor: only catches the path degrading into lock timeouts or retries.
+        self.assertGreater(attempts / elapsed, 20, f"{attempts} sells took {elapsed:.2f}s")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SellBatchTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Batch')
+        self.products = [
+            Product.objects.create(product_number=f'BATCH{i}', name=f'Batch {i}', category=category) for i in range(2)
+        ]
+        self.user = User.objects.create_user(username='batcher', password='x')
+        for product in self.products:
+            UserInventory.objects.create(user=self.user, product=product, quantity=10)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sell(self, *lines):
+        lines = [{'product_id': product.id, 'quantity': quantity} for product, quantity in lines]
+        return self.client.post('/api/sell/batch/', {'lines': lines}, format='json')
+
+    def stock(self):
+        return list(UserInventory.objects.filter(user=self.user).order_by('product_id').values_list('quantity', flat=True))
+
+    def test_short_line_rolls_back_the_batch(self):
+        first, second = self.products
+        response = self.sell((first, 4), (second, 11))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['applied'], 0)
+        self.assertEqual(
+            [result['message'] for result in response.data['results']],
+            ["Not sold because another line in the batch failed", "Only 10 available, but requested 11"],
+        )
+        self.assertEqual(self.stock(), [10, 10])
+        self.assertFalse(Sales.objects.exists())
+        self.assertFalse(DailySalesRollup.objects.exists())
+
+    def test_duplicate_lines_are_merged(self):
+        first, second = self.products
+        # 6 + 6 of the first product is more than its stock even though each line fits.
+        response = self.sell((first, 6), (second, 1), (first, 6))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['results'][2]['message'], "Only 10 available, but requested 12")
+        self.assertEqual(self.stock(), [10, 10])
+
+        response = self.sell((first, 6), (second, 1), (first, 4))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['applied'], 3)
+        self.assertEqual(self.stock(), [0, 9])
+        self.assertEqual(Sales.objects.filter(product=first).count(), 2)
+        self.assertEqual(DailySalesRollup.objects.get(product=first).qty, 10)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BuyBatchTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Buy')
+        self.products = [
+            Product.objects.create(product_number=f'BUY{i}', name=f'Buy {i}', category=category, lead_time=i + 2)
+            for i in range(2)
+        ]
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Arrival dates count from the UTC date, as in BuyProductView.
+        self.today = timezone.now().date()
+
+    def buy(self, *lines):
+        lines = [{'product_id': product_id, 'quantity': quantity} for product_id, quantity in lines]
+        return self.client.post('/api/buy/batch/', {'lines': lines}, format='json')
+
+    def orders(self):
+        return sorted(IncomingInventory.objects.values_list('user_id', 'product_id', 'arrival_date', 'quantity'))
+
+    def test_duplicate_lines_are_merged(self):
+        first, second = self.products
+        arrival = self.today + timedelta(days=first.lead_time)
+        IncomingInventory.objects.create(user=self.user, product=first, quantity=1, arrival_date=arrival)
+
+        response = self.buy((first.id, 4), (second.id, 2), (first.id, 5))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['applied'], response.data['failed']), (3, 0))
+        self.assertEqual(response.data['results'][1]['message'], f"2 Buy 1 will arrive on {self.today + timedelta(days=3)}")
+        # Both lines for the first product join the order already due that day.
+        self.assertEqual(self.orders(), [
+            (self.user.id, first.id, arrival, 10),
+            (self.user.id, second.id, self.today + timedelta(days=3), 2),
+        ])
+        self.assertEqual(ProjectionChange.objects.pending()[1], {self.user.id: {first.id, second.id}})
+
+    def test_unknown_product_fails_the_batch(self):
+        first, _ = self.products
+        response = self.buy((first.id, 4), (999999, 1))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['applied'], 0)
+        self.assertEqual(
+            [result['message'] for result in response.data['results']],
+            ["Not ordered because another line in the batch failed", "Product not found"],
+        )
+        self.assertEqual(self.orders(), [])
+        self.assertFalse(ProjectionChange.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ImporterTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Import')
+        self.widget = Product.objects.create(product_number='IMP1', name='Widget', category=category)
+        self.gadget = Product.objects.create(product_number='IMP2', name='Gadget', category=category)
+        # Two products share this name, so it can only be imported by number.
+        Product.objects.create(product_number='IMP3', name='Twin', category=category)
+        Product.objects.create(product_number='IMP4', name='Twin', category=category)
+        self.user = User.objects.create_user(username='importer', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.today = timezone.localdate()
+
+    def upload(self, kind, name, content, **data):
+        upload = SimpleUploadedFile(name, content)
+        return self.client.post(f'/api/import/{kind}/', {'file': upload, **data}, format='multipart')
+
+    def test_format_detection(self):
+        self.assertEqual(importer.detect_format('sales.CSV'), 'csv')
+        self.assertEqual(importer.detect_format('sales.ndjson'), 'ndjson')
+        self.assertEqual(importer.detect_format('sales.jsonl'), 'ndjson')
+        self.assertEqual(importer.detect_format('sales.txt', 'csv'), 'csv')
+        for name, fmt in (('sales.txt', None), ('sales.csv', 'xml')):
+            with self.assertRaises(ValueError):
+                importer.detect_format(name, fmt)
+
+        response = self.upload('sales', 'sales.txt', b'product_number,quantity\nIMP1,1\n')
+        self.assertEqual(response.status_code, 400)
+        response = self.upload('sales', 'sales.txt', b'product_number,quantity\nIMP1,1\n', format='csv')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['rows'], 1)
+
+    def test_lookup_by_number_and_name(self):
+        content = (
+            b'product_number,name,quantity,sale_date\n'
+            b'IMP1,,2,\n'
+            b',Gadget,3,2024-01-05\n'
+            b'IMP2,Widget,4,2024-01-05\n'
+            b',Twin,1,\n'
+            b'IMP3,Twin,5,\n'
+        )
+        response = self.upload('sales', 'sales.csv', content)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['rows'], 4)
+        self.assertEqual(response.data['error_rows'], [
+            {'line': 5, 'error': "Product name 'Twin' is ambiguous; use product_number"},
+        ])
+        # product_number wins over name when both are given.
+        self.assertEqual(
+            sorted(Sales.objects.values_list('product__product_number', 'quantity', 'sale_date')),
+            [('IMP1', 2, self.today), ('IMP2', 3, date(2024, 1, 5)), ('IMP2', 4, date(2024, 1, 5)), ('IMP3', 5, self.today)],
+        )
+        self.assertEqual(DailySalesRollup.objects.get(product=self.gadget, date=date(2024, 1, 5)).qty, 7)
+
+    def test_backdated_sales_by_date_range(self):
+        content = b'product_number,quantity,sale_date\nIMP1,5,2024-01-05\nIMP2,1,\n'
+        self.assertEqual(self.upload('sales', 'sales.csv', content).status_code, 201)
+        backdated = Sales.objects.get(product=self.widget)
+        self.assertEqual(timezone.localdate(backdated.timestamp), date(2024, 1, 5))
+
+        listed = self.client.get('/api/sales/?start=2024-01-01&end=2024-01-31')
+        self.assertEqual([row['id'] for row in listed.data['results']], [backdated.id])
+        # Newest first puts today's sale ahead of the backdated one.
+        listed = self.client.get('/api/sales/')
+        self.assertEqual(listed.data['results'][-1]['id'], backdated.id)
+
+        exported = self.client.get('/api/export/sales.csv?start=2024-01-01&end=2024-01-31')
+        lines = b''.join(exported.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith(f'{backdated.id},{self.widget.id},IMP1,5,2024-01-05,'))
+
+    def test_bad_rows(self):
+        lines = [
+            {'product_number': 'IMP1', 'quantity': 3, 'arrival_date': '2024-02-01'},
+            {'product_number': 'NOPE', 'quantity': 1, 'arrival_date': '2024-02-01'},
+            {'product_number': 'IMP1', 'quantity': 0, 'arrival_date': '2024-02-01'},
+            {'product_number': 'IMP1', 'quantity': 'many', 'arrival_date': '2024-02-01'},
+            {'product_number': 'IMP1', 'quantity': 1, 'arrival_date': '2024-02-30'},
+            {'name': 'Nothing', 'quantity': 1, 'arrival_date': '2024-02-01'},
+            [1, 2],
+            {'product_number': 'IMP1', 'quantity': 2, 'arrival_date': '2024-02-01'},
+        ]
+        content = '\n'.join(json.dumps(line) for line in lines) + '\n{not json\n'
+        response = self.upload('incoming', 'orders.ndjson', content.encode())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['rows'], response.data['errors']), (2, 7))
+        self.assertEqual([row['line'] for row in response.data['error_rows']], [2, 3, 4, 5, 6, 7, 9])
+        self.assertEqual(response.data['error_rows'][1]['error'], "quantity must be at least 1")
+        order = IncomingInventory.objects.get(user=self.user)
+        self.assertEqual((order.product_id, order.arrival_date, order.quantity), (self.widget.id, date(2024, 2, 1), 5))
+
+        response = self.upload('incoming', 'orders.ndjson', b'{not json\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['rows'], 0)
+
+    def test_products_upsert_and_create_categories(self):
+        content = b'product_number,name,category,lead_time\nIMP1,Widget Pro,Import,3\nIMP9,Sprocket,Parts,\n'
+        response = self.upload('products', 'products.csv', content)
+        self.assertEqual(response.status_code, 201)
+        self.widget.refresh_from_db()
+        self.assertEqual((self.widget.name, self.widget.lead_time), ('Widget Pro', 3))
+        sprocket = Product.objects.get(product_number='IMP9')
+        self.assertEqual((sprocket.category.name, sprocket.lead_time), ('Parts', 0))
+
+    def test_non_utf8_upload(self):
+        response = self.upload('sales', 'sales.csv', 'product_number,name,quantity\n,Caf\xe9,1\n'.encode('latin-1'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"error": "The file must be UTF-8 text"})
+        self.assertFalse(Sales.objects.exists())
+
+        # A bad byte after the first chunk must not leave the earlier chunks imported.
+        rows = b'IMP1,1\n' * (importer.CHUNK_SIZE + 500)
+        response = self.upload('sales', 'sales.csv', b'product_number,quantity\n' + rows + b'IMP1,1\xff\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Sales.objects.exists())
+
+        # A byte order mark is not part of the first column's name.
+        response = self.upload('sales', 'sales.csv', b'\xef\xbb\xbfproduct_number,quantity\nIMP1,1\n')
+        self.assertEqual(response.status_code, 201)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExportTests(TestCase):
+
+    SALES = 8
+
+    def setUp(self):
+        category = Category.objects.create(name='Export')
+        self.product = Product.objects.create(product_number='EXP1', name='Export 1', category=category)
+        self.user = User.objects.create_user(username='exporter', password='x')
+        other = User.objects.create_user(username='bystander', password='x')
+        Sales.objects.bulk_create(
+            [Sales(user=self.user, product=self.product, quantity=i + 1) for i in range(self.SALES)]
+            + [Sales(user=other, product=self.product, quantity=99)]
+        )
+        # Every timestamp ties, so only the id orders the rows and separates the chunks.
+        Sales.objects.update(timestamp=timezone.now())
+        self.today = timezone.localdate()
+        OldUserInventory.objects.bulk_create([
+            OldUserInventory(user=self.user, product=self.product, quantity=10 * i, date=self.today - timedelta(days=i))
+            for i in range(3)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def download(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_spans_chunks(self):
+        with mock.patch.object(export, 'CHUNK_SIZE', 3):
+            response, body = self.download('/api/export/sales.csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(
+            response['Content-Disposition'], f'attachment; filename="sales-{self.today.isoformat()}.csv"'
+        )
+        lines = body.splitlines()
+        self.assertEqual(lines[0], 'id,product_id,product_number,quantity,sale_date,timestamp')
+        rows = lines[1:]
+        self.assertEqual(len(rows), self.SALES)
+        ids = list(Sales.objects.filter(user=self.user).order_by('id').values_list('id', flat=True))
+        self.assertEqual([int(row.split(',')[0]) for row in rows], ids)
+        self.assertEqual([int(row.split(',')[3]) for row in rows], list(range(1, self.SALES + 1)))
+
+    def test_ndjson_lines(self):
+        response, body = self.download(f'/api/export/inventory-history.ndjson?start={self.today - timedelta(days=1)}')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertTrue(body.endswith('\n'))
+        self.assertEqual([json.loads(line) for line in body.splitlines()], [
+            {
+                'product_id': self.product.id, 'product_number': 'EXP1',
+                'date': (self.today - timedelta(days=1)).isoformat(), 'quantity': 10,
+            },
+            {'product_id': self.product.id, 'product_number': 'EXP1', 'date': self.today.isoformat(), 'quantity': 0},
+        ])
+
+    def test_unknown_export(self):
+        self.assertEqual(self.client.get('/api/export/sales.xml').status_code, 404)
+        self.assertEqual(self.client.get('/api/export/users.csv').status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Pages')
+        self.products = [
+            Product.objects.create(product_number=f'PAGE{i}', name=f'Page {i}', category=category) for i in range(3)
+        ]
+        self.user = User.objects.create_user(username='pager', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.today = timezone.localdate()
+
+    def pages(self, url):
+        """Ids on each page, following `next` to the end."""
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([row['id'] for row in response.data['results']])
+            url = response.data['next']
+        return pages
+
+    def test_sales_newest_first_across_tied_timestamps(self):
+        Sales.objects.bulk_create([Sales(user=self.user, product=self.products[0], quantity=1) for _ in range(7)])
+        ids = sorted(Sales.objects.values_list('id', flat=True))
+        now = timezone.now()
+        # Three distinct timestamps, with ties on each side of every page boundary.
+        for chunk, offset in ((ids[:3], 0), (ids[3:5], 1), (ids[5:], 2)):
+            Sales.objects.filter(id__in=chunk).update(timestamp=now + timedelta(seconds=offset))
+
+        pages = self.pages('/api/sales/?page_size=2')
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        self.assertEqual(sum(pages, []), ids[5:][::-1] + ids[3:5][::-1] + ids[:3][::-1])
+
+    def test_incoming_soonest_first_across_tied_dates(self):
+        IncomingInventory.objects.bulk_create([
+            IncomingInventory(
+                user=self.user, product=product, quantity=1, arrival_date=self.today + timedelta(days=days),
+            )
+            for days in (3, 1, 2) for product in self.products
+        ])
+        expected = list(
+            IncomingInventory.objects.order_by('arrival_date', 'id').values_list('id', flat=True)
+        )
+        pages = self.pages('/api/incoming/?page_size=2')
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 2, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_cursor_round_trip(self):
+        Sales.objects.bulk_create([Sales(user=self.user, product=self.products[0], quantity=1) for _ in range(3)])
+        first = self.client.get('/api/sales/?page_size=2')
+        cursor = first.data['next'].split('cursor=')[1].split('&')[0]
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor))
+        last = Sales.objects.get(id=first.data['results'][-1]['id'])
+        self.assertEqual((datetime.fromisoformat(value), pk), (last.timestamp, last.id))
+        # The page size is kept in the next link.
+        self.assertIn('page_size=2', first.data['next'])
+        second = self.client.get(first.data['next'])
+        self.assertEqual(len(second.data['results']), 1)
+        self.assertIsNone(second.data['next'])
+
+    def test_bad_cursor(self):
+        bad = [
+            'not base64!',
+            base64.urlsafe_b64encode(b'not json').decode(),
+            base64.urlsafe_b64encode(b'[1]').decode(),
+            base64.urlsafe_b64encode(b'["yesterday", 1]').decode(),
+            base64.urlsafe_b64encode(b'["2024-01-01T00:00:00", "x"]').decode(),
+        ]
+        for cursor in bad:
+            response = self.client.get('/api/sales/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertEqual(response.data, {'cursor': ['Invalid cursor']})
+
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ValuesListTests(TestCase):
+    """List endpoints read .values() rows but must render what the serializers render."""
+
+    def setUp(self):
+        categories = [Category.objects.create(name=f'Values {i}') for i in range(2)]
+        self.products = [
+            Product.objects.create(
+                product_number=f'VAL{i}', name=f'Values {i}', category=categories[i % 2], lead_time=i,
+            )
+            for i in range(3)
+        ]
+        self.user = User.objects.create_user(username='values', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def render(self, data):
+        return json.loads(JSONRenderer().render(data))
+
+    def listed(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        return data['results'] if isinstance(data, dict) else data
+
+    def test_products(self):
+        expected = ProductSerializer(Product.objects.all(), many=True).data
+        self.assertEqual(self.listed('/api/products/'), self.render(expected))
+
+    def test_sales(self):
+        for i, product in enumerate(self.products):
+            Sales.objects.create(user=self.user, product=product, quantity=i + 1)
+        Sales.objects.create(
+            user=User.objects.create_user(username='values-other', password='x'), product=self.products[0], quantity=9,
+        )
+        sales = Sales.objects.filter(user=self.user).order_by('-timestamp', '-id')
+        self.assertEqual(self.listed('/api/sales/'), self.render(SalesSerializer(sales, many=True).data))
+
+    def test_incoming(self):
+        today = timezone.localdate()
+        for i, product in enumerate(self.products):
+            IncomingInventory.objects.create(
+                user=self.user, product=product, quantity=i + 1, arrival_date=today + timedelta(days=3 - i),
+            )
+        incoming = IncomingInventory.objects.filter(user=self.user).order_by('arrival_date', 'id')
+        self.assertEqual(
+            self.listed('/api/incoming/'), self.render(IncomingInventorySerializer(incoming, many=True).data)
+        )
+
+    def test_inventory_serializer(self):
+        # No view lists UserInventory, but the reader must handle its serializer too.
+        for i, product in enumerate(self.products):
+            UserInventory.objects.create(user=self.user, product=product, quantity=i)
+        reader = reader_for(InventorySerializer)
+        rows = UserInventory.objects.order_by('id').values(*reader.paths)
+        expected = InventorySerializer(UserInventory.objects.order_by('id'), many=True).data
+        self.assertEqual(self.render(reader.read(rows)), self.render(expected))
+
+    def test_sales_list_query_count(self):
+        Sales.objects.bulk_create([
+            Sales(user=self.user, product=self.products[i % 3], quantity=1) for i in range(1000)
+        ])
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.listed('/api/sales/?page_size=1000')), 1000)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.listed('/api/sales/?page_size=10')), 10)
+
+
+class SalesRollupTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Rollup')
+        self.product = Product.objects.create(product_number='ROLL1', name='Rollup 1', category=category)
+        self.user = User.objects.create_user(username='rollup', password='x')
+        self.today = timezone.localdate()
+
+    def test_add_and_remove(self):
+        DailySalesRollup.objects.add(self.user, self.product, self.today, 5)
+        DailySalesRollup.objects.add(self.user, self.product, self.today, 3)
+        DailySalesRollup.objects.add(self.user, self.product, self.today, -6)
+        self.assertEqual(DailySalesRollup.objects.get().qty, 2)
+
+    def test_remove_without_a_row_is_logged(self):
+        with self.assertLogs('api.models', 'WARNING') as logs:
+            DailySalesRollup.objects.add(self.user, self.product, self.today, -4)
+        self.assertIn('rebuild_sales_rollup', logs.output[0])
+        self.assertFalse(DailySalesRollup.objects.exists())
+
+        # Deleting a sale whose day was never rolled up still succeeds.
+        sale = Sales.objects.create(user=self.user, product=self.product, quantity=4)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.assertLogs('api.models', 'WARNING'):
+            self.assertEqual(client.delete(f'/api/sales/{sale.id}/').status_code, 204)
+        self.assertFalse(DailySalesRollup.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ChangeJournalTests(TestCase):
+    """Edits mark the pair they leave as well as the one they land on."""
+
+    def setUp(self):
+        category = Category.objects.create(name='Journal')
+        self.old, self.new = [
+            Product.objects.create(product_number=f'J{i}', name=f'Journal {i}', category=category) for i in range(2)
+        ]
+        self.user = User.objects.create_user(username='journal', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def changes(self, request):
+        ProjectionChange.objects.all().delete()
+        response = request()
+        self.assertLess(response.status_code, 300, getattr(response, 'data', None))
+        return ProjectionChange.objects.pending()[1]
+
+    def test_sale_update_and_delete(self):
+        sale = Sales.objects.create(user=self.user, product=self.old, quantity=2)
+        DailySalesRollup.objects.create(user=self.user, product=self.old, date=sale.sale_date, qty=2)
+        changed = self.changes(lambda: self.client.patch(
+            f'/api/sales/{sale.id}/', {'product_id': self.new.id, 'quantity': 3}, format='json'
+        ))
+        self.assertEqual(changed, {self.user.id: {self.old.id, self.new.id}})
+        self.assertEqual(
+            sorted(DailySalesRollup.objects.values_list('product_id', 'qty')), [(self.old.id, 0), (self.new.id, 3)]
+        )
+
+        changed = self.changes(lambda: self.client.delete(f'/api/sales/{sale.id}/'))
+        self.assertEqual(changed, {self.user.id: {self.new.id}})
+
+    def test_incoming_update_and_delete(self):
+        order = IncomingInventory.objects.create(
+            user=self.user, product=self.old, quantity=4, arrival_date=timezone.localdate() + timedelta(days=2),
+        )
+        changed = self.changes(lambda: self.client.patch(
+            f'/api/incoming/{order.id}/', {'product_id': self.new.id}, format='json'
+        ))
+        self.assertEqual(changed, {self.user.id: {self.old.id, self.new.id}})
+
+        changed = self.changes(lambda: self.client.delete(f'/api/incoming/{order.id}/'))
+        self.assertEqual(changed, {self.user.id: {self.new.id}})
+
+    def test_pending_up_to(self):
+        other = User.objects.create_user(username='other-journal', password='x')
+        ProjectionChange.objects.mark([(self.user.id, self.old.id)])
+        last_id = ProjectionChange.objects.get().id
+        ProjectionChange.objects.mark([(other.id, self.new.id), (self.user.id, self.old.id)])
+        self.assertEqual(ProjectionChange.objects.pending(up_to=last_id), (last_id, {self.user.id: {self.old.id}}))
+        last, changed = ProjectionChange.objects.pending()
+        self.assertGreater(last, last_id)
+        self.assertEqual(changed, {self.user.id: {self.old.id}, other.id: {self.new.id}})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ArrivalTests(TestCase):
+    """update_incoming receives every order due today or earlier in one pass."""
+
+    def setUp(self):
+        category = Category.objects.create(name='Arrivals')
+        self.stocked, self.unstocked = [
+            Product.objects.create(product_number=f'ARR{i}', name=f'Arrival {i}', category=category) for i in range(2)
+        ]
+        self.users = [User.objects.create_user(username=f'arrivals{i}', password='x') for i in range(2)]
+        self.today = timezone.localdate()
+
+    def order(self, user, product, quantity, days):
+        return IncomingInventory.objects.create(
+            user=user, product=product, quantity=quantity, arrival_date=self.today + timedelta(days=days),
+        )
+
+    def test_receives_due_orders(self):
+        first, second = self.users
+        for user in self.users:
+            UserInventory.objects.create(user=user, product=self.stocked, quantity=10)
+        # Overdue and due today for the same pair, summed into one bump.
+        self.order(first, self.stocked, 3, -2)
+        self.order(first, self.stocked, 4, 0)
+        self.order(second, self.stocked, 5, 0)
+        self.order(first, self.unstocked, 6, -1)
+        later = self.order(first, self.stocked, 7, 1)
+        OldIncomingInventory.objects.create(user=first, product=self.stocked, quantity=1, arrival_date=self.today)
+
+        self.assertEqual(jobs.update_incoming(), 4)
+
+        self.assertEqual(
+            sorted(UserInventory.objects.values_list('user_id', 'product_id', 'quantity')),
+            sorted([
+                (first.id, self.stocked.id, 17), (second.id, self.stocked.id, 15), (first.id, self.unstocked.id, 6),
+            ]),
+        )
+        self.assertEqual(
+            sorted(OldIncomingInventory.objects.values_list('user_id', 'product_id', 'arrival_date', 'quantity')),
+            sorted([
+                (first.id, self.stocked.id, self.today - timedelta(days=2), 3),
+                (first.id, self.stocked.id, self.today, 5),
+                (second.id, self.stocked.id, self.today, 5),
+                (first.id, self.unstocked.id, self.today - timedelta(days=1), 6),
+            ]),
+        )
+        self.assertEqual(list(IncomingInventory.objects.values_list('id', flat=True)), [later.id])
+        self.assertEqual(ProjectionChange.objects.pending()[1], {
+            first.id: {self.stocked.id, self.unstocked.id}, second.id: {self.stocked.id},
+        })
+
+    def test_nothing_due(self):
+        self.order(self.users[0], self.stocked, 2, 3)
+        self.assertEqual(jobs.update_incoming(), 0)
+        self.assertEqual(IncomingInventory.objects.count(), 1)
+        self.assertFalse(UserInventory.objects.exists())
+        self.assertFalse(ProjectionChange.objects.exists())
+
+
+class SnapshotTests(TestCase):
+    """update_oldOnHand keeps one on-hand row per (user, product, day), updated in place."""
+
+    def setUp(self):
+        category = Category.objects.create(name='Snapshot')
+        self.products = [
+            Product.objects.create(product_number=f'SNAP{i}', name=f'Snapshot {i}', category=category) for i in range(2)
+        ]
+        self.user = User.objects.create_user(username='snapshot', password='x')
+        self.stock = [UserInventory.objects.create(user=self.user, product=p, quantity=5) for p in self.products]
+        self.today = timezone.localdate()
+
+    def snapshot(self):
+        return sorted(OldUserInventory.objects.values_list('product_id', 'date', 'quantity'))
+
+    def test_upsert(self):
+        yesterday = self.today - timedelta(days=1)
+        OldUserInventory.objects.create(user=self.user, product=self.products[0], quantity=9, date=yesterday)
+
+        self.assertEqual(jobs.update_oldOnHand(), 2)
+        first, second = self.products
+        self.assertEqual(self.snapshot(), [
+            (first.id, yesterday, 9), (first.id, self.today, 5), (second.id, self.today, 5),
+        ])
+
+        # Unchanged rows are not rewritten; a changed one is updated in place.
+        self.assertEqual(jobs.update_oldOnHand(), 0)
+        UserInventory.objects.filter(id=self.stock[1].id).update(quantity=2)
+        self.assertEqual(jobs.update_oldOnHand(), 1)
+        self.assertEqual(self.snapshot(), [
+            (first.id, yesterday, 9), (first.id, self.today, 5), (second.id, self.today, 2),
+        ])
+
+
+class LeaderTests(TestCase):
+    """Only one holder may own a lease until it expires or is released."""
+
+    def lease(self, name='test'):
+        return RunnerLease.objects.values_list('holder', 'expires_at').get(name=name)
+
+    def test_live_lease_refuses_a_second_holder(self):
+        self.assertTrue(leader.acquire('test', 60, holder='a'))
+        self.assertFalse(leader.acquire('test', 60, holder='b'))
+        self.assertEqual(self.lease()[0], 'a')
+        # The holder renews its own lease.
+        _, expires_at = self.lease()
+        self.assertTrue(leader.acquire('test', 120, holder='a'))
+        self.assertGreater(self.lease()[1], expires_at)
+
+    def test_expired_lease_is_taken_over(self):
+        self.assertTrue(leader.acquire('test', 60, holder='a'))
+        RunnerLease.objects.filter(name='test').update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(leader.acquire('test', 60, holder='b'))
+        self.assertEqual(self.lease()[0], 'b')
+        self.assertFalse(leader.acquire('test', 60, holder='a'))
+
+    def test_release_by_another_holder_is_a_no_op(self):
+        self.assertTrue(leader.acquire('test', 60, holder='a'))
+        before = self.lease()
+        leader.release('test', holder='b')
+        self.assertEqual(self.lease(), before)
+        self.assertFalse(leader.acquire('test', 60, holder='b'))
+
+        leader.release('test', holder='a')
+        self.assertTrue(leader.acquire('test', 60, holder='b'))
+
+    def test_run_once_skips_when_another_runner_holds_the_lease(self):
+        self.assertTrue(leader.acquire(updater.LEASE, 60, holder='other-runner'))
+        with mock.patch.object(updater, 'schedule_api') as schedule_api:
+            with self.assertLogs('jobs.updater', 'INFO'):
+                self.assertFalse(updater.run_once())
+            schedule_api.assert_not_called()
+
+            leader.release(updater.LEASE, holder='other-runner')
+            self.assertTrue(updater.run_once())
+            schedule_api.assert_called_once_with()
+        self.assertEqual(self.lease(updater.LEASE)[0], leader.HOLDER)
+
+
+def write_projections(user_ids, day):
+    """Project `user_ids` for `day` and write the rows, as one shard of a run does."""
+    writer = MetricsWriter()
+    for row in jobs.project_users(user_ids, day):
+        writer.add(**row)
+    return writer.close()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProjectionWriterTests(TestCase):
+
+    def setUp(self):
+        caches['projections'].clear()
+        category = Category.objects.create(name='Writer')
+        self.product = Product.objects.create(product_number='W1', name='Writer 1', category=category, lead_time=2)
+        self.user = User.objects.create_user(username='writer', password='x')
+        UserInventory.objects.create(user=self.user, product=self.product, quantity=100)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.today = timezone.localdate()
+
+    def test_zeroed_projection_is_deleted(self):
+        sold = self.client.post('/api/sell/', {'product_id': self.product.id, 'quantity': 70}, format='json')
+        self.assertEqual(sold.status_code, 201)
+        first = write_projections([self.user.id], self.today)
+        self.assertEqual(first['inserted'], 14)
+        tomorrow = (self.today + timedelta(days=1)).isoformat()
+        soq = self.client.get(f'/api/get-soq/?product_id={self.product.id}&date={tomorrow}')
+        self.assertEqual(soq.status_code, 200)
+
+        sale = Sales.objects.get(user=self.user)
+        self.assertEqual(self.client.delete(f'/api/sales/{sale.id}/').status_code, 204)
+        # The cache version is bumped once the rows commit.
+        with self.captureOnCommitCallbacks(execute=True):
+            second = write_projections([self.user.id], self.today)
+        self.assertEqual((second['inserted'], second['updated'], second['deleted']), (0, 0, 14))
+        self.assertFalse(DailyInventoryMetrics.objects.filter(user=self.user, is_projection=True).exists())
+        soq = self.client.get(f'/api/get-soq/?product_id={self.product.id}&date={tomorrow}')
+        self.assertEqual(soq.status_code, 404)
+
+        third = write_projections([self.user.id], self.today)
+        self.assertEqual((third['deleted'], third['skipped']), (0, 14))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PROJECTION_SHARD_SIZE=1, PROJECTION_INSTRUMENT=True, PROJECTION_PROFILE_DIR=None)
+class ProjectionRunTests(TransactionTestCase):
+    """schedule_api end to end: one shard per user, with run_date pinned to today."""
+
+    USERS = 3
+
+    def setUp(self):
+        self.today = timezone.localdate()
+        category = Category.objects.create(name='Run')
+        self.products = [
+            Product.objects.create(product_number=f'RUN{i}', name=f'Run {i}', category=category, lead_time=i + 1)
+            for i in range(2)
+        ]
+        self.users = [User.objects.create_user(username=f'run{i}', password='x') for i in range(self.USERS)]
+        for user in self.users:
+            for product in self.products:
+                UserInventory.objects.create(user=user, product=product, quantity=20)
+                DailySalesRollup.objects.create(user=user, product=product, date=self.today, qty=7)
+        patcher = mock.patch.object(jobs, 'run_date', return_value=self.today)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stages_are_recorded(self):
+        jobs.schedule_api()
+        run = ProjectionRun.objects.get()
+        self.assertEqual(run.status, 'succeeded')
+        projected = self.USERS * len(self.products) * 14
+        self.assertEqual(run.stages['write']['rows'], projected)
+        self.assertEqual(run.stages['projection']['rows'], projected)
+        return run.stages
+
+    def test_parallel_stages_match_serial(self):
+        serial = self.test_stages_are_recorded()
+        DailyInventoryMetrics.objects.all().delete()
+        ProjectionRun.objects.all().delete()
+        ProjectionSweep.objects.all().delete()
+        with override_settings(PROJECTION_WORKERS=3):
+            jobs.schedule_api()
+        parallel = ProjectionRun.objects.get().stages
+        self.assertEqual(parallel.keys(), serial.keys())
+        for name in ('load', 'projection', 'write'):
+            self.assertEqual(parallel[name]['rows'], serial[name]['rows'], name)
+            self.assertEqual(parallel[name]['queries'], serial[name]['queries'], name)
+
+    def fail_for(self, user, times=None):
+        """Patch project_users to raise for `user`'s shard, `times` times or always."""
+        project_users = jobs.project_users
+        calls = []
+        failures = []
+
+        def project(user_ids, *args, **kwargs):
+            calls.append(list(user_ids))
+            if user.id in user_ids and (times is None or len(failures) < times):
+                failures.append(user.id)
+                raise RuntimeError("shard failed")
+            return project_users(user_ids, *args, **kwargs)
+
+        patcher = mock.patch.object(jobs, 'project_users', side_effect=project)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return calls
+
+    def test_crash_then_resume(self):
+        first, second, third = self.users
+        calls = self.fail_for(second, times=1)
+        with self.assertRaises(RuntimeError):
+            jobs.schedule_api()
+        run = ProjectionRun.objects.get()
+        self.assertEqual((run.status, run.watermark, run.attempts), ('failed', first.id, 1))
+
+        calls.clear()
+        jobs.schedule_api()
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.watermark, run.attempts), ('succeeded', third.id, 2))
+        # Only the shards after the watermark ran again.
+        self.assertEqual(calls, [[second.id], [third.id]])
+        self.assertEqual(ProjectionRun.objects.count(), 1)
+        self.assertEqual(
+            DailyInventoryMetrics.objects.filter(is_projection=True).count(), self.USERS * len(self.products) * 14
+        )
+
+    @override_settings(PROJECTION_MAX_ATTEMPTS=2)
+    def test_run_is_abandoned_after_max_attempts(self):
+        self.fail_for(self.users[1])
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                jobs.schedule_api()
+        run = ProjectionRun.objects.get()
+        self.assertEqual((run.status, run.attempts), ('failed', 2))
+
+        # The next tick gives up on it and plans a fresh run.
+        with self.assertRaises(RuntimeError):
+            jobs.schedule_api()
+        old, fresh = ProjectionRun.objects.order_by('id')
+        self.assertEqual(old.status, 'abandoned')
+        self.assertEqual((fresh.status, fresh.attempts), ('failed', 1))
+
+    def test_celery_shards_checkpoint(self):
+        first, second, third = self.users
+        plan = jobs.prepare_run(self.today)
+        run = ledger.start(plan)
+        # Shards commit out of order; a resumed run only redoes the missing one.
+        for user in (third, first):
+            tasks.project_shard([user.id], self.today.isoformat(), None, run.id)
+        run.refresh_from_db()
+        self.assertEqual(run.done_shards, [[third.id, third.id], [first.id, first.id]])
+        self.assertEqual(jobs.prepare_run(self.today, resume=run).shards, [[second.id]])
+
+    def test_celery_planning_failure_releases_lease(self):
+        with mock.patch.object(tasks, 'run_date', return_value=self.today), \
+                mock.patch.object(tasks, 'prepare_run', side_effect=RuntimeError("planning failed")):
+            with self.assertRaises(RuntimeError):
+                tasks.run_projections()
+        self.assertTrue(leader.acquire(tasks.LEASE, 60, holder='next-runner'))
+
+@override_settings(OCR_BACKEND='api.ocr.FakeBackend')
+class OcrCacheTests(TestCase):
+    """A rescanned image is answered from OcrResult without calling the backend again."""
+
+    def setUp(self):
+        self.backend = ocr.get_backend()
+        self.backend.calls = 0
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='scanner', password='x'))
+
+    def scan(self, content):
+        return self.client.post(
+            '/api/process-image/', {'image': base64.b64encode(content).decode()}, format='json'
+        )
+
+    def test_repeat_scan_is_cached(self):
+        label = b'SKU 1042\nWidget blue'
+        first = self.scan(label)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.data['texts'], ['SKU', '1042', 'Widget', 'blue'])
+        with self.assertNumQueries(1):
+            second = self.scan(label)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(self.backend.calls, 1)
+        self.assertEqual(OcrResult.objects.count(), 1)
+
+    def test_key_covers_options_and_errors_are_not_cached(self):
+        self.assertNotEqual(ocr.cache_key(b'same', 'text'), ocr.cache_key(b'same', 'document'))
+        for _ in range(2):
+            self.assertEqual(self.scan(b'error: image too blurry').status_code, 400)
+        self.assertEqual(self.backend.calls, 2)
+        self.assertFalse(OcrResult.objects.exists())
+
+
+@override_settings(OCR_BACKEND='api.ocr.FakeBackend')
+class OcrJobQueueTests(TestCase):
+    """Submitting only enqueues; workers answer pending jobs in batched backend calls."""
+
+    def setUp(self):
+        self.backend = ocr.get_backend()
+        self.backend.calls = self.backend.images = 0
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='queuer', password='x'))
+
+    def submit(self, content, feature='document'):
+        response = self.client.post(
+            '/api/ocr/jobs/', {'image': base64.b64encode(content).decode(), 'feature': feature}, format='json'
+        )
+        self.assertEqual(response.status_code, 202)
+        return response
+
+    def test_submit_then_poll(self):
+        labels = [f'SKU {i}'.encode() for i in range(5)] + [b'SKU 0', b'error: unreadable']
+        submitted = [self.submit(label) for label in labels]
+        self.assertEqual({response.data['status'] for response in submitted}, {'pending'})
+        self.assertEqual(self.backend.calls, 0)
+
+        self.assertEqual(ocr_jobs.process_batch(batch_size=16), len(labels))
+        self.assertEqual(ocr_jobs.process_batch(batch_size=16), 0)
+        # One call for the batch, with the repeated label sent once.
+        self.assertEqual((self.backend.calls, self.backend.images), (1, 6))
+
+        polled = [self.client.get(response['Location']).data for response in submitted]
+        self.assertEqual([job['status'] for job in polled], ['done'] * 6 + ['failed'])
+        self.assertEqual(polled[3]['result']['words'][1]['text'], '3')
+        self.assertEqual(polled[5]['result'], polled[0]['result'])
+        self.assertEqual(polled[6]['error'], 'unreadable')
+        self.assertFalse(OcrJob.objects.exclude(content=b'').exists())
+
+    def test_cached_image_is_done_on_submit(self):
+        self.submit(b'Widget blue', feature='text')
+        ocr_jobs.process_batch(batch_size=16)
+        again = self.submit(b'Widget blue', feature='text')
+        self.assertEqual(again.data['status'], 'done')
+        self.assertEqual(again.data['result'], {'text': 'Widget blue'})
+        self.assertEqual(self.backend.calls, 1)
+
+    def test_jobs_are_private(self):
+        job = self.submit(b'SKU 9')
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='other', password='x'))
+        self.assertEqual(other.get(job['Location']).status_code, 404)
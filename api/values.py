@@ -0,0 +1,73 @@
+"""Fast list serialization from .values() rows.
+
+A ValuesReader is compiled once per serializer class. It walks the
+serializer's readable fields into a flat list of .values() paths and reuses
+each DRF field's to_representation, so its output is the same JSON the
+serializer produces, but lists skip model instances and nested serializers.
+"""
+from functools import lru_cache
+
+from rest_framework import serializers
+from rest_framework.response import Response
+
+UNSUPPORTED = (serializers.FileField, serializers.SerializerMethodField, serializers.HiddenField)
+
+
+class ValuesReader:
+
+    def __init__(self, serializer, prefix=''):
+        self.pk_path = prefix + serializer.Meta.model._meta.pk.attname
+        self.fields = []
+        self.paths = [self.pk_path]
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if field.source == '*' or '.' in field.source or isinstance(field, UNSUPPORTED):
+                raise TypeError(f"{type(serializer).__name__}.{name} cannot be read from values()")
+            path = prefix + field.source
+            if isinstance(field, serializers.ModelSerializer):
+                nested = ValuesReader(field, prefix=path + '__')
+                self.fields.append((name, nested.pk_path, nested))
+                self.paths.extend(nested.paths)
+            elif isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+                # values() already yields the related id.
+                self.fields.append((name, path, None))
+                self.paths.append(path)
+            elif isinstance(field, serializers.RelatedField):
+                raise TypeError(f"{type(serializer).__name__}.{name} cannot be read from values()")
+            else:
+                self.fields.append((name, path, field.to_representation))
+                self.paths.append(path)
+        self.paths = list(dict.fromkeys(self.paths))
+
+    def read_row(self, row):
+        data = {}
+        for name, path, represent in self.fields:
+            value = row[path]
+            if value is None or represent is None:
+                data[name] = value
+            elif isinstance(represent, ValuesReader):
+                data[name] = represent.read_row(row)
+            else:
+                data[name] = represent(value)
+        return data
+
+    def read(self, rows):
+        return [self.read_row(row) for row in rows]
+
+
+@lru_cache(maxsize=None)
+def reader_for(serializer_class):
+    return ValuesReader(serializer_class())
+
+
+class ValuesListMixin:
+    """list() for generic views that serializes .values() rows instead of model instances."""
+
+    def list(self, request, *args, **kwargs):
+        reader = reader_for(self.get_serializer_class())
+        queryset = self.filter_queryset(self.get_queryset()).values(*reader.paths)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(reader.read(page))
+        return Response(reader.read(queryset))
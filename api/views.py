@@ -3,7 +3,10 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView
 from api.models import User
-from .models import Category, Product, Sales, IncomingInventory
+from .models import Category, Product, Sales, IncomingInventory, DailySalesRollup, ProjectionChange
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.db.models import F
 from django.utils import timezone
 from rest_framework.exceptions import ValidationError
 
@@ -12,16 +15,21 @@ from .serializers import (
     CategorySerializer, ProductSerializer,
      SalesSerializer,
     IncomingInventorySerializer,
-    BuyProductSerializer,SellProductSerializer,UserInventory
+    BuyProductSerializer,SellProductSerializer,UserInventory,
+    OrderBatchSerializer, OcrJobSerializer, OcrJobSubmitSerializer,
 )
-from google.cloud import vision
 from .serializers import ImageProcessingSerializer
 import os
 import base64
+import codecs
+import hashlib
 from django.conf import settings
-from rest_framework.parsers import MultiPartParser
+from rest_framework.parsers import JSONParser, MultiPartParser
 from .serializers import ImageUploadSerializer,DailyInventoryMetricsSerializer
-from .models import DailyInventoryMetrics, Product
+from .models import DailyInventoryMetrics, OcrJob, Product
+from . import export, filters, importer, metrics, ocr, projection_cache
+from .pagination import IncomingInventoryPagination, SalesPagination
+from .values import ValuesListMixin
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.join(settings.BASE_DIR, 'service_account.json')
 class ImageTextExtractView(APIView):
     parser_classes = (MultiPartParser,)
@@ -30,25 +38,19 @@ class ImageTextExtractView(APIView):
         serializer = ImageUploadSerializer(data=request.data)
         if serializer.is_valid():
             image_instance = serializer.save()
-            image_path = os.path.join(settings.MEDIA_ROOT, str(image_instance.image))
             
-            # Initialize Google Vision client
-            client = vision.ImageAnnotatorClient()
-            
-            with open(image_path, 'rb') as image_file:
+            with image_instance.image.open('rb') as image_file:
                 content = image_file.read()
             
-            image = vision.Image(content=content)
-            response = client.text_detection(image=image)
-            texts = response.text_annotations
+            result = ocr.annotate(content, 'text')
             
-            if response.error.message:
+            if 'error' in result:
                 return Response(
-                    {'error': response.error.message},
+                    {'error': result['error']},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
             
-            extracted_text = texts[0].description if texts else "No text found"
+            extracted_text = result['text'] or "No text found"
             
             return Response({
                 'image_id': image_instance.id,
@@ -64,45 +66,19 @@ class ProcessProductImageView(APIView):
         serializer.is_valid(raise_exception=True)
        
         try:
-            client = vision.ImageAnnotatorClient()
-            image_base64 = serializer.validated_data['image']
-            image_content = base64.b64decode(image_base64)
-            image = vision.Image(content=image_content)
+            image_content = base64.b64decode(serializer.validated_data['image'])
             
-            # Use document_text_detection instead of text_detection for better results
-            response = client.document_text_detection(
-                image=image,
-                image_context=vision.ImageContext(
-                    language_hints=["en"],
-                    text_detection_params=vision.TextDetectionParams(
-                        enable_text_detection_confidence_score=True
-                    )
-                )
-            )
+            # Document text detection; words come back in reading order
+            # (top to bottom, left to right) with their positions.
+            result = ocr.annotate(image_content, 'document')
             
-            if response.error.message:
+            if 'error' in result:
                 return Response(
-                    {'error': response.error.message},
+                    {'error': result['error']},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Process text blocks with their positions
-            detected_texts = []
-            for page in response.full_text_annotation.pages:
-                for block in page.blocks:
-                    for paragraph in block.paragraphs:
-                        for word in paragraph.words:
-                            word_text = ''.join([symbol.text for symbol in word.symbols])
-                            detected_texts.append({
-                                'text': word_text,
-                                'confidence': word.confidence,
-                                'bounds': [(vertex.x, vertex.y) for vertex in word.bounding_box.vertices]
-                            })
-            
-            # Sort text by reading order (top to bottom, left to right)
-            detected_texts.sort(key=lambda x: (x['bounds'][0][1], x['bounds'][0][0]))
-            
-            # Extract all text in order
+            detected_texts = result['words']
             ordered_text = [item['text'] for item in detected_texts]
             
             return Response({
@@ -116,6 +92,25 @@ class ProcessProductImageView(APIView):
                 {'error': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+class OcrJobSubmitView(APIView):
+    """Queue an image for OCR and return the job at once; poll OcrJobDetailView for the result."""
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = (JSONParser, MultiPartParser)
+
+    def post(self, request):
+        serializer = OcrJobSubmitSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = ocr.submit(request.user, serializer.validated_data['content'], serializer.validated_data['feature'])
+        response = Response(OcrJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+        response['Location'] = f'/api/ocr/jobs/{job.id}/'
+        return response
+
+class OcrJobDetailView(generics.RetrieveAPIView):
+    serializer_class = OcrJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return OcrJob.objects.filter(user=self.request.user).defer('content')
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -146,12 +141,14 @@ class BuyProductView(generics.CreateAPIView):
         arrival_date = timezone.now().date() + timezone.timedelta(days=product.lead_time)
         
         # Create incoming inventory record
-        IncomingInventory.objects.create(
-            user=user,
-            product=product,
-            quantity=quantity,
-            arrival_date=arrival_date
-        )
+        with transaction.atomic():
+            IncomingInventory.objects.create(
+                user=user,
+                product=product,
+                quantity=quantity,
+                arrival_date=arrival_date
+            )
+            ProjectionChange.objects.mark([(user.id, product.id)])
         
         return Response(
             {"message": f"{quantity} {product.name} will arrive on {arrival_date}"},
@@ -169,33 +166,149 @@ class SellProductView(generics.CreateAPIView):
         quantity = serializer.validated_data['quantity']
         user = request.user
         
-        # Get user's inventory
-        try:
-            inventory = UserInventory.objects.get(user=user, product=product)
-        except UserInventory.DoesNotExist:
-            raise ValidationError("You don't have any of this product in stock")
-        
-        # Check available quantity
-        if inventory.quantity < quantity:
+        stock = UserInventory.objects.filter(user=user, product=product)
+        with transaction.atomic():
+            # The stock check and decrement are one conditional UPDATE, so
+            # concurrent sells cannot both spend the same units.
+            sold = stock.filter(quantity__gte=quantity).update(quantity=F('quantity') - quantity)
+            if sold:
+                # Record sale
+                sale = Sales.objects.create(
+                    user=user,
+                    product=product,
+                    quantity=quantity
+                )
+                DailySalesRollup.objects.add(user, product, sale.sale_date, quantity)
+                ProjectionChange.objects.mark([(user.id, product.id)])
+
+        if not sold:
+            available = stock.values_list('quantity', flat=True).first()
+            if available is None:
+                raise ValidationError("You don't have any of this product in stock")
             raise ValidationError(
-                f"Only {inventory.quantity} available, but requested {quantity}"
+                f"Only {available} available, but requested {quantity}"
             )
         
-        # Update inventory
-        inventory.quantity -= quantity
-        inventory.save()
-        
-        # Record sale
-        Sales.objects.create(
-            user=user,
-            product=product,
-            quantity=quantity
-        )
-        
         return Response(
             {"message": f"Successfully sold {quantity} {product.name}"},
             status=status.HTTP_201_CREATED
         )
+def batch_response(results):
+    """Per-line results; 201 when the batch was applied, 400 when it was not.
+
+    Buy and sell batches are all or nothing, so either every line is applied
+    or none is.
+    """
+    applied = sum(result['ok'] for result in results)
+    return Response(
+        {"applied": applied, "failed": len(results) - applied, "results": results},
+        status=status.HTTP_201_CREATED if applied else status.HTTP_400_BAD_REQUEST,
+    )
+
+def line_result(index, line, message, ok=True):
+    return {"line": index, "product_id": line['product_id'], "quantity": line['quantity'], "ok": ok, "message": message}
+
+class BuyBatchView(generics.CreateAPIView):
+    """Order many products at once; an unknown product fails the whole batch."""
+    serializer_class = OrderBatchSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lines = serializer.validated_data['lines']
+        user = request.user
+        products = Product.objects.in_bulk({line['product_id'] for line in lines})
+
+        today = timezone.now().date()
+        missing = {line['product_id'] for line in lines} - products.keys()
+        results = []
+        for index, line in enumerate(lines):
+            product = products.get(line['product_id'])
+            if product is None:
+                results.append(line_result(index, line, "Product not found", ok=False))
+            elif missing:
+                results.append(line_result(index, line, "Not ordered because another line in the batch failed", ok=False))
+            else:
+                arrival_date = today + timezone.timedelta(days=product.lead_time)
+                results.append(line_result(index, line, f"{line['quantity']} {product.name} will arrive on {arrival_date}"))
+
+        if not missing:
+            ordered = {}
+            for line in lines:
+                product = products[line['product_id']]
+                key = (product.id, today + timezone.timedelta(days=product.lead_time))
+                ordered[key] = ordered.get(key, 0) + line['quantity']
+            with transaction.atomic():
+                # Lines arriving on a day that already has an order are added to it.
+                IncomingInventory.objects.add_many({
+                    (user.id, product_id, arrival_date): quantity
+                    for (product_id, arrival_date), quantity in ordered.items()
+                })
+                ProjectionChange.objects.mark([(user.id, product_id) for product_id, _ in ordered])
+        return batch_response(results)
+
+class SellBatchView(generics.CreateAPIView):
+    """Sell many products at once; an unknown or short product fails the whole batch."""
+    serializer_class = OrderBatchSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lines = serializer.validated_data['lines']
+        user = request.user
+        products = Product.objects.in_bulk({line['product_id'] for line in lines})
+
+        # Repeated lines for a product are sold as one.
+        wanted = {}
+        for line in lines:
+            wanted[line['product_id']] = wanted.get(line['product_id'], 0) + line['quantity']
+
+        stock = UserInventory.objects.filter(user=user)
+        failed = {}
+        with transaction.atomic():
+            # Each product is one conditional UPDATE, as in SellProductView, so
+            # concurrent sells cannot both spend the same units. The batch is
+            # all or nothing: any short product rolls every line back.
+            for product_id, quantity in wanted.items():
+                if product_id not in products:
+                    failed[product_id] = "Product not found"
+                elif not stock.filter(product_id=product_id, quantity__gte=quantity).update(
+                    quantity=F('quantity') - quantity
+                ):
+                    failed[product_id] = None
+
+            if failed:
+                transaction.set_rollback(True)
+            else:
+                sales = Sales.objects.bulk_create(
+                    [Sales(user=user, product_id=line['product_id'], quantity=line['quantity']) for line in lines]
+                )
+                totals = {}
+                for sale in sales:
+                    key = (user.id, sale.product_id, sale.sale_date)
+                    totals[key] = totals.get(key, 0) + sale.quantity
+                DailySalesRollup.objects.add_many(totals)
+                ProjectionChange.objects.mark([(user.id, product_id) for product_id in wanted])
+
+        if failed:
+            available = dict(stock.filter(product_id__in=failed).values_list('product_id', 'quantity'))
+            for product_id, message in failed.items():
+                if message is None and product_id not in available:
+                    failed[product_id] = "You don't have any of this product in stock"
+                elif message is None:
+                    failed[product_id] = f"Only {available[product_id]} available, but requested {wanted[product_id]}"
+
+        results = []
+        for index, line in enumerate(lines):
+            product_id = line['product_id']
+            if not failed:
+                results.append(line_result(index, line, f"Successfully sold {line['quantity']} {products[product_id].name}"))
+            elif product_id in failed:
+                results.append(line_result(index, line, failed[product_id], ok=False))
+            else:
+                results.append(line_result(index, line, "Not sold because another line in the batch failed", ok=False))
+        return batch_response(results)
+
 class CategoryListCreateView(generics.ListCreateAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
@@ -206,13 +319,13 @@ class CategoryDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticated]
 
-class ProductListCreateView(generics.ListCreateAPIView):
-    queryset = Product.objects.all()
+class ProductListCreateView(ValuesListMixin, generics.ListCreateAPIView):
+    queryset = Product.objects.select_related('category')
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
 
 class ProductDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related('category')
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -222,65 +335,105 @@ class ProductDetailView(generics.RetrieveUpdateDestroyAPIView):
 #     queryset = Sales.objects.all()
 #     serializer_class = SalesSerializer
 #    permission_classes = [permissions.IsAuthenticated]
-class SalesListCreateView(generics.ListCreateAPIView):
+class SalesListCreateView(ValuesListMixin, generics.ListCreateAPIView):
     serializer_class = SalesSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = SalesPagination
 
     def get_queryset(self):
-        """Return only the current user's sales"""
-        return Sales.objects.filter(user=self.request.user)
+        """Return only the current user's sales, optionally within ?start=&end="""
+        queryset = Sales.objects.filter(user=self.request.user).select_related('product__category')
+        return filters.date_range(queryset, 'timestamp', self.request.query_params)
 
+    @transaction.atomic
     def perform_create(self, serializer):
         """Automatically assign the current user to new sales"""
-        serializer.save(user=self.request.user)
+        sale = serializer.save(user=self.request.user)
+        DailySalesRollup.objects.add(sale.user, sale.product, sale.sale_date, sale.quantity)
+        ProjectionChange.objects.mark([(sale.user_id, sale.product_id)])
 class SalesDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Sales.objects.all()
+    queryset = Sales.objects.select_related('user', 'product__category')
     serializer_class = SalesSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    @transaction.atomic
+    def perform_update(self, serializer):
+        """Move the old quantity out of the rollup and the new one in"""
+        old = serializer.instance
+        old_pair = (old.user_id, old.product_id)
+        DailySalesRollup.objects.add(old.user, old.product, old.sale_date, -old.quantity)
+        sale = serializer.save()
+        DailySalesRollup.objects.add(sale.user, sale.product, sale.sale_date, sale.quantity)
+        ProjectionChange.objects.mark([old_pair, (sale.user_id, sale.product_id)])
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        DailySalesRollup.objects.add(instance.user, instance.product, instance.sale_date, -instance.quantity)
+        ProjectionChange.objects.mark([(instance.user_id, instance.product_id)])
+        instance.delete()
+
 
 class IncomingInventoryDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = IncomingInventory.objects.all()
+    queryset = IncomingInventory.objects.select_related('product__category')
     serializer_class = IncomingInventorySerializer
     permission_classes = [permissions.IsAuthenticated]
 
-class IncomingInventoryListCreateView(generics.ListCreateAPIView):
+    @transaction.atomic
+    def perform_update(self, serializer):
+        old_pair = (serializer.instance.user_id, serializer.instance.product_id)
+        incoming = serializer.save()
+        ProjectionChange.objects.mark([old_pair, (incoming.user_id, incoming.product_id)])
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        ProjectionChange.objects.mark([(instance.user_id, instance.product_id)])
+        instance.delete()
+
+class IncomingInventoryListCreateView(ValuesListMixin, generics.ListCreateAPIView):
     serializer_class = IncomingInventorySerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = IncomingInventoryPagination
 
     def get_queryset(self):
         # Return only the incoming inventory for the current authenticated user
-        return IncomingInventory.objects.filter(user=self.request.user)
+        queryset = IncomingInventory.objects.filter(user=self.request.user).select_related('product__category')
+        return filters.date_range(queryset, 'arrival_date', self.request.query_params)
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        incoming = serializer.save()
+        ProjectionChange.objects.mark([(incoming.user_id, incoming.product_id)])
 
 
 class MetricsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
-    
+
     def get(self, request, product_id):
-        # Implement your metrics calculation logic here
-        # This should return all 9 metrics as shown in the Excel example
-        # You'll need to implement the complex calculations for:
-        # - Forecast (7-day rolling average)
-        # - Order Point (sum of forecast based on lead time)
-        # - Projected On-Hand
-        # - SOQ (Suggested Order Quantity)
-        # - Planned Arrival
-        
-        # Placeholder response - you'll need to implement the actual calculations
-        return Response({
-            "product_id": product_id,
-            "metrics": {
-                "sales": [],
-                "on_hand": [],
-                "incoming": [],
-                "order_point": [],
-                "lead_time": 0,
-                "forecast": [],
-                "projected_on_hand": [],
-                "soq": [],
-                "planned_arrival": []
-            }
-        })
+        today = timezone.localdate()
+        try:
+            start, end = metrics.date_range(request.query_params, today)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The key changes whenever a projection run rewrites this user's rows.
+        key = projection_cache.key(request.user.id, 'metrics', product_id, start, end, today)
+        etag = f'"{hashlib.md5(key.encode()).hexdigest()}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        def build():
+            series = metrics.metrics_series(request.user.id, product_id, start, end, today)
+            if series['lead_time'] is None:
+                lead_time = Product.objects.filter(id=product_id).values_list('lead_time', flat=True).first()
+                if lead_time is None:
+                    return None
+                series['lead_time'] = lead_time
+            return {"product_id": product_id, "metrics": series}
+
+        payload = projection_cache.get_or_compute(key, build)
+        if payload is None:
+            return Response({"error": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(payload, headers={'ETag': etag})
 class GetSOQAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]  # Require JWT authentication
 
@@ -292,6 +445,12 @@ class GetSOQAPIView(APIView):
         if not product_id or not date:
             return Response({"error": "Missing required parameters (product_id, date)"}, status=status.HTTP_400_BAD_REQUEST)
 
+        key = projection_cache.key(user.id, 'soq', product_id, date)
+        data, code = projection_cache.get_or_compute(key, lambda: self.lookup(user, product_id, date))
+        return Response(data, status=code)
+
+    def lookup(self, user, product_id, date):
+        # Misses are cached too; they can only turn into hits after a projection run.
         try:
             product = Product.objects.get(id=product_id)
             metric = DailyInventoryMetrics.objects.get(
@@ -300,8 +459,68 @@ class GetSOQAPIView(APIView):
                 date=date,
             )
             serializer = DailyInventoryMetricsSerializer(metric)
-            return Response(serializer.data)
+            return serializer.data, status.HTTP_200_OK
         except Product.DoesNotExist:
-            return Response({"error": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
+            return {"error": "Product not found"}, status.HTTP_404_NOT_FOUND
         except DailyInventoryMetrics.DoesNotExist:
-            return Response({"error": "No data found for this combination"}, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+            return {"error": "No data found for this combination"}, status.HTTP_404_NOT_FOUND
+class BatchSOQAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        return self.soq(request, request.query_params)
+
+    def post(self, request):
+        # Same lookup with the ids in the body, for lists too long for a query string.
+        return self.soq(request, request.data)
+
+    def soq(self, request, params):
+        try:
+            product_ids = metrics.product_ids(params)
+            start, end = metrics.date_range(params, timezone.localdate(), history=0)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        key = projection_cache.key(request.user.id, 'soq-batch', product_ids, start, end)
+        return Response(projection_cache.get_or_compute(
+            key, lambda: metrics.soq_matrix(request.user.id, product_ids, start, end)
+        ))
+class ExportView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, dataset, fmt):
+        if dataset not in export.DATASETS or fmt not in export.STREAMERS:
+            return Response(
+                {"error": f"Unknown export {dataset}.{fmt}; datasets: {', '.join(export.DATASETS)}; formats: csv, ndjson"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        model, field, columns = export.DATASETS[dataset]
+        queryset = filters.date_range(model.objects.filter(user=request.user), field, request.query_params)
+        response = StreamingHttpResponse(
+            export.STREAMERS[fmt](columns, export.export_chunks(queryset, field, columns)),
+            content_type=export.CONTENT_TYPES[fmt],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{dataset}-{timezone.localdate()}.{fmt}"'
+        return response
+class ImportView(APIView):
+    """Upload a CSV/NDJSON `file` of products, sales or incoming orders; see api.importer."""
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = (MultiPartParser,)
+
+    def post(self, request, kind):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "Upload the data as a 'file' field"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            fmt = importer.detect_format(upload.name, request.data.get('format'))
+            run = importer.Importer(kind, user=request.user)
+            importer.check_utf8(upload.chunks())
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        upload.seek(0)
+        report = run.run(codecs.iterdecode(upload, 'utf-8-sig'), fmt)
+        return Response(report, status=status.HTTP_201_CREATED if report['rows'] else status.HTTP_400_BAD_REQUEST)
+class ProjectionCacheStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(projection_cache.stats())
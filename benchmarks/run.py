@@ -0,0 +1,147 @@
+"""Scaling benchmark for the projection pipeline.
+
+    python -m benchmarks.run --grid 100x1 1000x10 --out bench_results.json
+
+Each grid point is PRODUCTSxUSERS. For every point a fresh SQLite database
+is migrated and filled by benchmarks.synthetic, then each pipeline stage is
+timed on its own. Wall time, query count and peak Python memory are written
+per stage, together with the commit, so results can be compared across
+commits run with the same seed.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+DEFAULT_GRID = ['10x1', '100x10', '1000x10', '10000x1', '100x500']
+
+
+def configure(db_path):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    from django.conf import settings
+    settings.DATABASES['default']['NAME'] = str(db_path)
+    import django
+    django.setup()
+
+
+@contextmanager
+def measure(results, stage, track_memory):
+    from django.db import connection
+
+    counter = {'queries': 0}
+
+    def count(execute, sql, params, many, context):
+        counter['queries'] += 1
+        return execute(sql, params, many, context)
+
+    if track_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with connection.execute_wrapper(count):
+        yield
+    seconds = time.perf_counter() - start
+    peak = None
+    if track_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    results[stage] = {
+        'seconds': round(seconds, 4),
+        'queries': counter['queries'],
+        'peak_kib': None if peak is None else peak // 1024,
+    }
+
+
+def run_point(db_path, products, users, seed, track_memory):
+    from django.core.management import call_command
+    from django.db import connections
+    from django.utils import timezone
+
+    from benchmarks import synthetic
+    from jobs import jobs
+    from jobs.writer import MetricsWriter
+
+    connections.close_all()
+    if db_path.exists():
+        db_path.unlink()
+    call_command('migrate', verbosity=0)
+    started = time.perf_counter()
+    data = synthetic.generate(products, users, seed=seed)
+    data['generate_seconds'] = round(time.perf_counter() - started, 2)
+
+    today = timezone.localdate()
+    stages = {}
+    with measure(stages, 'update_incoming', track_memory):
+        jobs.update_incoming()
+    with measure(stages, 'update_oldOnHand', track_memory):
+        jobs.update_oldOnHand()
+    # prepare_run would receive arrivals and snapshot again; those are timed above.
+    with measure(stages, 'plan', track_memory):
+        plan = jobs.plan_run(today)
+    rows = []
+    with measure(stages, 'predict_next', track_memory):
+        for _, shard in jobs.shard_rows(plan):
+            rows.extend(shard)
+    data['rows'] = len(rows)
+    with measure(stages, 'write', track_memory):
+        writer = MetricsWriter()
+        for row in rows:
+            writer.add(**row)
+        data['written'] = writer.close()
+    with measure(stages, 'finish', track_memory):
+        jobs.finish_run(plan)
+    data['stages'] = stages
+    return data
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--grid', nargs='+', default=DEFAULT_GRID, help="PRODUCTSxUSERS points")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', default='/tmp/projection-bench.sqlite3', help="Scratch SQLite file")
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--no-memory', action='store_true', help="Skip tracemalloc (faster, no peak_kib)")
+    args = parser.parse_args(argv)
+
+    db_path = Path(args.db)
+    configure(db_path)
+    from django.conf import settings
+
+    report = {
+        'commit': commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'seed': args.seed,
+        'workers': settings.PROJECTION_WORKERS,
+        'results': [],
+    }
+    for point in args.grid:
+        products, users = (int(n) for n in point.lower().split('x'))
+        result = run_point(db_path, products, users, args.seed, not args.no_memory)
+        report['results'].append(result)
+        timings = ', '.join(f"{name} {stage['seconds']}s/{stage['queries']}q" for name, stage in result['stages'].items())
+        print(f"{products} products x {users} users: {timings}", file=sys.stderr)
+        with open(args.out, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
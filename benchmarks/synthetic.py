@@ -0,0 +1,81 @@
+"""Deterministic synthetic tenant data for the projection benchmarks."""
+import io
+import random
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.utils import timezone
+
+from api.models import (
+    Category, IncomingInventory, OldUserInventory, Product, Sales, User, UserInventory,
+)
+
+LEAD_TIMES = [0, 1, 2, 3, 5, 7, 10, 14, 21, 30]
+BATCH_SIZE = 5000
+
+
+def generate(products, users, history_days=14, seed=0):
+    """Create `users` users each stocking all `products`, with history.
+
+    Every user/product pair gets on-hand, seven days of on-hand snapshots,
+    sales on roughly half of the last `history_days` days and, for about a
+    third of the pairs, one open purchase order arriving between two days
+    ago and three weeks out.
+    """
+    rnd = random.Random(seed)
+    today = timezone.localdate()
+
+    categories = Category.objects.bulk_create(
+        [Category(name=f"bench-{i}") for i in range(max(1, products // 50))]
+    )
+    catalog = Product.objects.bulk_create([
+        Product(
+            product_number=f"B{i:06d}",
+            name=f"Bench product {i}",
+            category=categories[i % len(categories)],
+            lead_time=rnd.choice(LEAD_TIMES),
+        )
+        for i in range(products)
+    ], batch_size=BATCH_SIZE)
+    accounts = User.objects.bulk_create(
+        [User(username=f"bench-{i}") for i in range(users)], batch_size=BATCH_SIZE
+    )
+
+    inventory, snapshots, incoming = [], [], []
+    sales = []
+    for user in accounts:
+        for product in catalog:
+            inventory.append(UserInventory(user=user, product=product, quantity=rnd.randint(0, 500)))
+            for back in range(1, 8):
+                snapshots.append(OldUserInventory(
+                    user=user, product=product, quantity=rnd.randint(0, 500),
+                    date=today - timedelta(days=back),
+                ))
+            for back in range(history_days):
+                if rnd.random() < 0.5:
+                    sales.append(Sales(
+                        user=user, product=product, quantity=rnd.randint(1, 40),
+                        sale_date=today - timedelta(days=back),
+                    ))
+            if rnd.random() < 0.3:
+                incoming.append(IncomingInventory(
+                    user=user, product=product, quantity=rnd.randint(1, 200),
+                    arrival_date=today + timedelta(days=rnd.randint(-2, 21)),
+                ))
+        if len(snapshots) >= BATCH_SIZE:
+            UserInventory.objects.bulk_create(inventory, batch_size=BATCH_SIZE)
+            OldUserInventory.objects.bulk_create(snapshots, batch_size=BATCH_SIZE)
+            inventory, snapshots = [], []
+    UserInventory.objects.bulk_create(inventory, batch_size=BATCH_SIZE)
+    OldUserInventory.objects.bulk_create(snapshots, batch_size=BATCH_SIZE)
+    IncomingInventory.objects.bulk_create(incoming, batch_size=BATCH_SIZE)
+
+    Sales.objects.bulk_create(sales, batch_size=BATCH_SIZE)
+    call_command('rebuild_sales_rollup', stdout=io.StringIO())
+
+    return {
+        'users': users,
+        'products': products,
+        'sales': len(sales),
+        'incoming': len(incoming),
+    }
@@ -44,7 +44,68 @@ INSTALLED_APPS = [
     'api',
     
 ]
-SCHEDULER_DEFAULT = True
+# Projection runs: users per shard, and worker processes (1 runs inline)
+PROJECTION_SHARD_SIZE = int(os.environ.get('PROJECTION_SHARD_SIZE', 50))
+PROJECTION_WORKERS = int(os.environ.get('PROJECTION_WORKERS', 1))
+# Seconds between runs of manage.py run_projections, and how long a runner's lease lasts
+PROJECTION_INTERVAL = int(os.environ.get('PROJECTION_INTERVAL', 300))
+PROJECTION_LEASE_SECONDS = int(os.environ.get('PROJECTION_LEASE_SECONDS', 900))
+# A run that has failed or stalled this many times is abandoned and the next
+# tick plans a fresh one, which also picks up journal entries added since
+PROJECTION_MAX_ATTEMPTS = int(os.environ.get('PROJECTION_MAX_ATTEMPTS', 3))
+# Record per-stage timings of each run in ProjectionRun; optionally keep a
+# cProfile dump of the slowest stage in PROJECTION_PROFILE_DIR
+PROJECTION_INSTRUMENT = os.environ.get('PROJECTION_INSTRUMENT', '') == '1'
+PROJECTION_PROFILE_DIR = os.environ.get('PROJECTION_PROFILE_DIR') or None
+
+# Cached SOQ/metrics reads are keyed by a per-user projection version that
+# the job bumps, so the timeout only bounds storage. The projections alias is
+# file based so web and job processes see the same versions.
+PROJECTION_CACHE_SECONDS = 24 * 60 * 60
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'projections': {
+        'BACKEND': os.environ.get('PROJECTION_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('PROJECTION_CACHE_LOCATION', os.path.join(BASE_DIR, 'var', 'cache', 'projections')),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# OCR backend (api.ocr.FakeBackend reads image bytes as text, for tests and
+# local runs without Vision credentials) and the Vision clients it keeps open
+OCR_BACKEND = os.environ.get('OCR_BACKEND', 'api.ocr.VisionBackend')
+OCR_CLIENT_POOL_SIZE = int(os.environ.get('OCR_CLIENT_POOL_SIZE', 2))
+# Queued OCR jobs (manage.py process_ocr_jobs): worker threads, which cap the
+# backend calls in flight, images per batch call, and when a running job whose
+# worker died is retried or, after the last attempt, failed
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', 4))
+OCR_BATCH_SIZE = int(os.environ.get('OCR_BATCH_SIZE', 16))
+OCR_JOB_TIMEOUT = int(os.environ.get('OCR_JOB_TIMEOUT', 300))
+OCR_MAX_ATTEMPTS = int(os.environ.get('OCR_MAX_ATTEMPTS', 3))
+
+# Celery (celery -A core worker -B). For local runs without RabbitMQ use
+# CELERY_BROKER_URL=memory:// or filesystem://, or CELERY_TASK_ALWAYS_EAGER=1.
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', '') == '1'
+CELERY_TASK_EAGER_PROPAGATES = True
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'amqp://guest@localhost//')
+# Chords need a result backend shared by all workers
+CELERY_RESULT_BACKEND = os.environ.get(
+    'CELERY_RESULT_BACKEND',
+    'cache+memory://' if CELERY_TASK_ALWAYS_EAGER
+    else 'file://' + str(BASE_DIR / 'var' / 'celery' / 'results'),
+)
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'data_folder_in': str(BASE_DIR / 'var' / 'celery' / 'queue'),
+    'data_folder_out': str(BASE_DIR / 'var' / 'celery' / 'queue'),
+}
+CELERY_BEAT_SCHEDULE = {
+    'projections': {
+        'task': 'jobs.tasks.run_projections',
+        'schedule': PROJECTION_INTERVAL,
+    },
+}
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -83,6 +144,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Transactions take the write lock when they begin, so one that reads
+        # before writing cannot deadlock upgrading its lock.
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+        # A file rather than shared-cache memory, whose table locks fail
+        # immediately instead of waiting, so threaded tests see real locking.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -134,6 +201,16 @@ REST_FRAMEWORK = {
     )
 }
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'jobs': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
 BASE_DIR = Path(__file__).resolve().parent.parent
 SERVICE_ACCOUNT_PATH = BASE_DIR / 'service_account.json'
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = str(SERVICE_ACCOUNT_PATH)
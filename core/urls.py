@@ -7,8 +7,9 @@ from api.views import (
     SalesListCreateView, SalesDetailView,
     IncomingInventoryListCreateView, IncomingInventoryDetailView,
     BuyProductSerializer,SellProductSerializer,
-    BuyProductView,SellProductView,
-    MetricsView,ProcessProductImageView,ImageTextExtractView,GetSOQAPIView
+    BuyProductView,SellProductView,BuyBatchView,SellBatchView,
+    MetricsView,ProcessProductImageView,ImageTextExtractView,GetSOQAPIView,BatchSOQAPIView,
+    ProjectionCacheStatsView,ExportView,ImportView,OcrJobSubmitView,OcrJobDetailView
 )
 from django.conf import settings
 from django.conf.urls.static import static
@@ -34,6 +35,8 @@ urlpatterns = [
     # Sales
     path('api/buy/', BuyProductView.as_view(), name='buy-product'),
     path('api/sell/', SellProductView.as_view(), name='sell-product'),
+    path('api/buy/batch/', BuyBatchView.as_view(), name='buy-batch'),
+    path('api/sell/batch/', SellBatchView.as_view(), name='sell-batch'),
     path('api/sales/', SalesListCreateView.as_view(), name='sales-list'),
     path('api/sales/<int:pk>/', SalesDetailView.as_view(), name='sales-detail'),
     
@@ -48,5 +51,11 @@ urlpatterns = [
 
     #img
     path('api/extract-text/', ImageTextExtractView.as_view(), name='extract-text'),
+    path('api/ocr/jobs/', OcrJobSubmitView.as_view(), name='ocr-job-submit'),
+    path('api/ocr/jobs/<int:pk>/', OcrJobDetailView.as_view(), name='ocr-job-detail'),
     path('api/get-soq/', GetSOQAPIView.as_view(), name='get-soq'),
+    path('api/get-soq/batch/', BatchSOQAPIView.as_view(), name='get-soq-batch'),
+    path('api/export/<slug:dataset>.<slug:fmt>', ExportView.as_view(), name='export'),
+    path('api/import/<slug:kind>/', ImportView.as_view(), name='import'),
+    path('api/projection-cache/stats/', ProjectionCacheStatsView.as_view(), name='projection-cache-stats'),
 ]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -0,0 +1,95 @@
+"""Opt-in per-stage instrumentation for projection runs.
+
+Enabled with settings.PROJECTION_INSTRUMENT. Each stage records wall time,
+query count and time (through a connection execute wrapper) and the rows it
+touched. A stage entered several times, such as once per shard, accumulates.
+With settings.PROJECTION_PROFILE_DIR set, every stage is also profiled and
+the slowest stage's cProfile dump is kept.
+"""
+import cProfile
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class RunRecorder:
+
+	def __init__(self, enabled=None, profile_dir=None):
+		if enabled is None:
+			enabled = settings.PROJECTION_INSTRUMENT
+		self.enabled = enabled
+		self.profile_dir = profile_dir if profile_dir is not None else settings.PROJECTION_PROFILE_DIR
+		self.stages = {}
+		self.profiles = {}
+		self.started_at = timezone.now()
+
+	@contextmanager
+	def stage(self, name):
+		"""Measure the enclosed block. Set ['rows'] on the yielded dict to record rows touched."""
+		entry = {'rows': 0}
+		if not self.enabled:
+			yield entry
+			return
+		stats = self.stages.setdefault(name, {'seconds': 0.0, 'queries': 0, 'query_seconds': 0.0, 'rows': 0})
+
+		def record_query(execute, sql, params, many, context):
+			start = time.perf_counter()
+			try:
+				return execute(sql, params, many, context)
+			finally:
+				stats['queries'] += 1
+				stats['query_seconds'] += time.perf_counter() - start
+
+		profiler = None
+		if self.profile_dir:
+			profiler = self.profiles.setdefault(name, cProfile.Profile())
+		start = time.perf_counter()
+		with connection.execute_wrapper(record_query):
+			if profiler:
+				profiler.enable()
+			try:
+				yield entry
+			finally:
+				if profiler:
+					profiler.disable()
+				stats['seconds'] += time.perf_counter() - start
+				stats['rows'] += entry['rows']
+
+	def merge(self, stages):
+		"""Add stage totals measured by another recorder, such as a shard worker's."""
+		if not self.enabled:
+			return
+		for name, measured in stages.items():
+			stats = self.stages.setdefault(name, {'seconds': 0.0, 'queries': 0, 'query_seconds': 0.0, 'rows': 0})
+			for field, value in measured.items():
+				stats[field] += value
+
+	def save(self, run):
+		"""Store the stages on the run's ProjectionRun row and log a one-line summary."""
+		if not self.enabled:
+			return
+		for stats in self.stages.values():
+			stats['seconds'] = round(stats['seconds'], 4)
+			stats['query_seconds'] = round(stats['query_seconds'], 4)
+		run.stages = self.stages
+		if self.profiles:
+			slowest = max(self.profiles, key=lambda name: self.stages[name]['seconds'])
+			os.makedirs(self.profile_dir, exist_ok=True)
+			run.profile_path = os.path.join(self.profile_dir, f"projection-run-{run.id}-{slowest}.prof")
+			self.profiles[slowest].dump_stats(run.profile_path)
+		run.save(update_fields=['stages', 'profile_path'])
+		logger.info(
+			"Projection run %d %s in %.2fs: %s", run.id, run.status,
+			((run.finished_at or timezone.now()) - self.started_at).total_seconds(),
+			', '.join(
+				f"{name} {stats['seconds']:.2f}s {stats['queries']}q/{stats['query_seconds']:.2f}s {stats['rows']} rows"
+				for name, stats in self.stages.items()
+			),
+		)
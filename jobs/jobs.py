@@ -1,238 +1,288 @@
 from django.conf import settings
-from django.contrib.auth import get_user_model
-from api.models import User,Product,Sales,IncomingInventory,UserInventory,OldIncomingInventory,OldUserInventory,DailyInventoryMetrics
+from api.models import User,Product,IncomingInventory,UserInventory,OldIncomingInventory,OldUserInventory,ProjectionChange,ProjectionSweep
 from datetime import datetime, timedelta
+import logging
 import pytz
-import time
+from collections import namedtuple
 
-from decimal import Decimal
-from django.db.models import Sum, Q
+from django.db import connection, transaction
+from django.db.models import Exists, F, Max, OuterRef, Subquery, Sum
+
+from . import ledger, parallel, prefetch, projection
+from .instrument import RunRecorder
+from .writer import MetricsWriter, RowCollector
+
+logger = logging.getLogger(__name__)
 def update_incoming():
+	"""Receive every purchase order due today or earlier, as one transaction."""
 	est = pytz.timezone('America/New_York')
 	now_est = datetime.now(est)
 
 	current_date = now_est.date()
-	incoming = IncomingInventory.objects.all()
-	hold_l=[]
-	for i in incoming:
-		if str(i.arrival_date)==str(current_date):
-			inventory, created = UserInventory.objects.get_or_create(
-                user=i.user,
-                product=i.product,
-                defaults={'quantity': i.quantity}
-            )
-			if not created:
-				inventory.quantity += i.quantity
-				inventory.save()
-			inventory2, created = OldIncomingInventory.objects.get_or_create(
-                user=i.user,
-                product=i.product,
-                quantity=i.quantity,
-				arrival_date = i.arrival_date
-            )
-			
-			hold_l.append(i)
-			
-	for v in hold_l:
-		v.delete()
+	with transaction.atomic():
+		arrived = IncomingInventory.objects.filter(arrival_date__lte=current_date)
+		last_id = arrived.aggregate(last=Max('id'))['last']
+		if last_id is None:
+			return 0
+		# Orders placed while this runs are left for the next run.
+		arrived = arrived.filter(id__lte=last_id)
+		rows = list(arrived.values_list('user_id', 'product_id', 'arrival_date', 'quantity'))
+		totals = {}
+		for user_id, product_id, arrival_date, quantity in rows:
+			totals[(user_id, product_id)] = totals.get((user_id, product_id), 0) + quantity
+
+		# Bump existing on-hand rows in a single UPDATE, create the rest.
+		due = arrived.filter(user=OuterRef('user'), product=OuterRef('product'))
+		# The id lists let the UPDATE seek the (user, product) index instead of probing every row.
+		stock = UserInventory.objects.filter(
+			Exists(due),
+			user_id__in={user_id for user_id, _ in totals},
+			product_id__in={product_id for _, product_id in totals},
+		)
+		stock.update(
+			quantity=F('quantity') + Subquery(
+				due.order_by().values('user').annotate(total=Sum('quantity')).values('total')
+			)
+		)
+		stocked = set(stock.values_list('user_id', 'product_id'))
+		UserInventory.objects.bulk_create([
+			UserInventory(user_id=user_id, product_id=product_id, quantity=quantity)
+			for (user_id, product_id), quantity in totals.items()
+			if (user_id, product_id) not in stocked
+		])
+
+		history = {
+			(h.user_id, h.product_id, h.arrival_date): h
+			for h in OldIncomingInventory.objects.filter(
+				user_id__in={row[0] for row in rows},
+				product_id__in={row[1] for row in rows},
+				arrival_date__in={row[2] for row in rows},
+			)
+		}
+		received = []
+		new_history = []
+		for user_id, product_id, arrival_date, quantity in rows:
+			entry = history.get((user_id, product_id, arrival_date))
+			if entry is None:
+				new_history.append(OldIncomingInventory(
+					user_id=user_id, product_id=product_id, quantity=quantity, arrival_date=arrival_date
+				))
+			else:
+				entry.quantity += quantity
+				received.append(entry)
+		OldIncomingInventory.objects.bulk_update(received, ['quantity'])
+		OldIncomingInventory.objects.bulk_create(new_history)
+
+		arrived.delete()
+		ProjectionChange.objects.mark(totals)
+	return len(rows)
 def update_oldOnHand():
+	"""Upsert today's on-hand snapshot for every inventory row in one statement."""
 	est = pytz.timezone('America/New_York')
 	now_est = datetime.now(est)
 
 	current_date = now_est.date()
-	inventry = UserInventory.objects.all()
-	
-	for i in inventry:
-		inventory2, created = OldUserInventory.objects.get_or_create(
-			
-                user=i.user,
-                product=i.product,
-                quantity=i.quantity,
-				date= current_date
-            )
-	pass
-def get_onHand(user,product,date):
-	return OldUserInventory.objects.filter(
-            user=user,
-            product=product,
-            date=date
-        ).aggregate(total=Sum('quantity'))['total'] or 0
-def get_leadtime(product):
-	for i in Product.objects.all():
-		if(i==product):
-			return i.lead_time
-	return 0
-def schedule_api():
+	qn = connection.ops.quote_name
+	snapshot = {f.name: qn(f.column) for f in OldUserInventory._meta.concrete_fields}
+	live = {f.name: qn(f.column) for f in UserInventory._meta.concrete_fields}
+	table = qn(OldUserInventory._meta.db_table)
+	# "WHERE 1=1" keeps SQLite from reading ON CONFLICT as a join clause.
+	sql = (
+		f"INSERT INTO {table} ({snapshot['user']}, {snapshot['product']}, {snapshot['quantity']}, {snapshot['date']}) "
+		f"SELECT {live['user']}, {live['product']}, {live['quantity']}, %s "
+		f"FROM {qn(UserInventory._meta.db_table)} WHERE 1=1 "
+		f"ON CONFLICT ({snapshot['user']}, {snapshot['product']}, {snapshot['date']}) "
+		f"DO UPDATE SET {snapshot['quantity']} = excluded.{snapshot['quantity']} "
+		f"WHERE {table}.{snapshot['quantity']} <> excluded.{snapshot['quantity']}"
+	)
+	with connection.cursor() as cursor:
+		cursor.execute(sql, [connection.ops.adapt_datefield_value(current_date)])
+		return cursor.rowcount
+def run_date():
+	"""Today's date in New York, or None before 11:00 when runs are skipped."""
 	est = pytz.timezone('America/New_York')
 	now_est = datetime.now(est)
+	if now_est.hour<11:
+		return None
+	return now_est.date()
 
-	current_date = now_est.date()
-	hour = now_est.hour
-	minute = now_est.minute
-	if hour<11:
+def schedule_api():
+	current_date = run_date()
+	if current_date is None:
 		return
-	update_incoming()
-	update_oldOnHand() #before if not cal todays+ inventory
-	users = User.objects.all()
-	products = Product.objects.all()
-	sales = Sales.objects.all()
-	incoming = IncomingInventory.objects.all()
-	
-	date_list = [(current_date - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7)]
+	if ledger.live_run(current_date):
+		logger.info("A projection run for %s is still in progress, skipping", current_date)
+		return
+	resumed = ledger.resumable_run(current_date)
+	recorder = RunRecorder()
+	plan = prepare_run(current_date, recorder, resume=resumed)
+	if plan is None:
+		return
+	if resumed is None:
+		run = ledger.start(plan)
+	else:
+		run = resumed
+		ledger.resume(run)
+		logger.info("Resuming projection run %d after user %s", run.id, run.watermark)
 
-	if(str(hour)=="23" and str(minute)=="59"):
-		pass
-	for user in users:
-		main_data={}
+	writer = MetricsWriter()
+	try:
+		for user_ids, rows in shard_rows(plan, recorder):
+			# A shard's whole horizon and the watermark commit together.
+			with transaction.atomic():
+				with recorder.stage('write') as stage:
+					written = writer.inserted + writer.updated + writer.deleted
+					for row in rows:
+						writer.add(**row)
+					writer.flush()
+					stage['rows'] = writer.inserted + writer.updated + writer.deleted - written
+				ledger.checkpoint(run, user_ids[-1])
+		with recorder.stage('finish'):
+			with transaction.atomic():
+				finish_run(plan)
+				ledger.finish(run, 'succeeded')
+	except Exception:
+		ledger.finish(run, 'failed')
+		recorder.save(run)
+		raise
+	writer.close()
+	recorder.save(run)
 
-		for product in products:
-			main_data[product]={"sales":{},"lead":product.lead_time,"incoming":{},"onhand":{}}
-			
-			for ideal_date in date_list:
-				main_data[product]["sales"][ideal_date]=0
-				main_data[product]["incoming"][ideal_date]=get_incoming_inventory(user=user,product=product,date=ideal_date)
-				main_data[product]["onhand"][ideal_date]=get_onHand(user=user,product=product,date=ideal_date)
-			for sale in sales:
-				if sale.product == product and sale.user==user:
-					if str(sale.sale_date) in date_list:
-						main_data[product]["sales"][str(sale.sale_date)]+=sale.quantity
-			
-		
-		predict_next(main_data=main_data,user=user)
-	
-def get_incoming_inventory( user, product, date):
-        """Get incoming inventory for a specific date"""
-        return OldIncomingInventory.objects.filter(
-            user=user,
-            product=product,
-            arrival_date=date
-        ).aggregate(total=Sum('quantity'))['total'] or 0
-
-def predict_next(main_data,user):
-	est = pytz.timezone('America/New_York')
-	now_est = datetime.now(est)
+RunPlan = namedtuple('RunPlan', ['date', 'full_sweep', 'last_change', 'changed', 'shards'])
 
-	current_date = now_est.date()
-	next_14_days = [(current_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(1, 15)]
-	for i in main_data.keys():
-		date_wise_projection={}
-		for dt in next_14_days:
-			lead=get_leadtime(i)
-			fc=calculate_forecast(product=i,date=dt,main_data=main_data,next_days=next_14_days)
-			inc=get_incoming_inventory(user=user,product=i,date=dt)
-			op=get_orderPoint(product=i,date=dt,main_data=main_data,lead_time=get_leadtime(i))
-			poh=get_projectedOnhand(po=True,main_data=main_data,fc=fc,inc=inc,to_date=dt,product=i,hist=date_wise_projection,lead=lead)
-			soq= get_soq(poh=poh,op=op)
-			planned_arrivel=get_projectedOnhand(po=False,main_data=main_data,fc=fc,inc=inc,to_date=dt,product=i,hist=date_wise_projection,lead=lead)
-			date_wise_projection[dt]=[poh,soq]
-			final_data={
-					"Date":dt,
-			   		"user":user,
-					"product":i,
-					"Is_projection":True,
-					"sales":0,
-					"On_hand":0,
-					"incoming":inc,
-					"Lead_Time":lead,
-					
-					"Forecast":fc,
-					"Order_Point":op,
-					
-					"projected_on_hand":poh,
-					"soq":soq,
-					"planned_arrivel":planned_arrivel
-					
-					}
-			savedb(final_data)
-			
-def savedb(data):
-	print(data)
-	if(data['Order_Point']==0 and data['Forecast']==0 and data['soq']==0):
-		return
-	max_retries = 5
-	for attempt in range(max_retries):
-		try:
-			metrics, created = DailyInventoryMetrics.objects.update_or_create(	
-			user = data['user'],
-			product = data['product'],
-			date = data['Date'],
-			is_projection = True,
-			# Core metrics
-			sales = data['sales'],
-			on_hand = data['On_hand'],
-			incoming = data['incoming'],
-			# Calculated metrics
-			order_point = data['Order_Point'],
-			lead_time_days = data['Lead_Time'],
-			forecast = data['Forecast'],
-			projected_on_hand = data['projected_on_hand'],
-			soq = data['soq'],
-			planned_arrival = data['planned_arrivel']
-				)
-			return
-		except:
-			time.sleep(2)
-			pass
-def get_projectedOnhand(po,main_data,fc,inc,to_date,product,hist,lead):
-
-	date_obj = datetime.strptime(to_date, "%Y-%m-%d").date()
-	previous_day = date_obj - timedelta(days=1)
-	est = pytz.timezone('America/New_York')
-	now_est = datetime.now(est)
+def prepare_run(current_date, recorder=None, resume=None):
+	"""Receive arrivals, snapshot on-hand and decide which users to project.
+
+	With `resume`, an unfinished ProjectionRun, its plan is rebuilt and the
+	users it already committed are left out. Returns a RunPlan, or None when nothing
+	changed since the last run.
+	"""
+	recorder = recorder or RunRecorder(enabled=False)
+	with recorder.stage('arrivals') as stage:
+		stage['rows'] = update_incoming()
+	with recorder.stage('snapshot') as stage:
+		stage['rows'] = update_oldOnHand() #before if not cal todays+ inventory
+	return plan_run(current_date, recorder, resume)
 
-	if(previous_day== now_est.date()):
-		print(main_data[product]['onhand'][str(previous_day)])
-		if po:
-			return main_data[product]['onhand'][str(previous_day)] - fc + inc + 0
+def plan_run(current_date, recorder=None, resume=None):
+	"""The planning step of prepare_run alone, for callers that ran arrivals and the snapshot themselves."""
+	recorder = recorder or RunRecorder(enabled=False)
+	with recorder.stage('plan') as stage:
+		if resume is not None:
+			full_sweep, last_change = resume.full_sweep, resume.last_change
+			changed = {}
+			if last_change is not None:
+				changed = ProjectionChange.objects.pending(up_to=last_change)[1]
 		else:
-			return 0
-	else:
-		x = date_obj - timedelta(days=lead)
-		arriaval =0
-		if x in hist:
-			arriaval = hist[x][1]
-		if po:
-			return hist[str(previous_day)][0] - fc + inc + arriaval
+			# The first run of each day recomputes everything since the forecast
+			# window moved; later runs only redo pairs recorded in the change journal.
+			full_sweep = not ProjectionSweep.objects.filter(date=current_date).exists()
+			last_change, changed = ProjectionChange.objects.pending()
+			if not full_sweep and not changed:
+				return None
+		if full_sweep:
+			user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+			changed = None
 		else:
-			return arriaval	
-def get_soq(poh,op):
-	if poh<op:
-		return op-poh
-	else: 
-		return 0
-
-def calculate_forecast(product,date,main_data,next_days):
-	all_data=[]
-	for i in main_data[product]["sales"].keys():
-		all_data.append(main_data[product]["sales"][i])
-	for i in next_days:
-		print('###########')
-		print(all_data)
-		vel =sum(all_data[:7])/7
-		all_data.insert(0,vel)
-		if(i==date):
-			return round(vel,2)
-	pass	
-def get_orderPoint(product,date,main_data,lead_time):
-	est = pytz.timezone('America/New_York')
-	now_est = datetime.now(est)
+			user_ids = sorted(changed)
+		if resume is not None:
+			user_ids = ledger.remaining(resume, user_ids)
+		stage['rows'] = len(user_ids)
+	size = settings.PROJECTION_SHARD_SIZE
+	shards = [user_ids[i:i + size] for i in range(0, len(user_ids), size)]
+	return RunPlan(current_date, full_sweep, last_change, changed, shards)
 
-	current_date = now_est.date()
-	next_x_days = [(current_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(1, 15+lead_time)]
-	
-	all_data=[]
-	all_date=[]
-	for i in main_data[product]["sales"].keys():
-		all_data.append(main_data[product]["sales"][i])
-		all_date.append(i)
-	for i in next_x_days:
-		vel =sum(all_data[:7])/7
-		all_data.insert(0,vel)
-		all_date.insert(0,i)
-	x = all_date.index(date)
-	total_point=0
-	for i in range(lead_time):
-		total_point+=all_data[x]
-		x-=1
-	return round(total_point,2)
+def shard_rows(plan, recorder=None):
+	"""Yield (user_ids, rows) for each shard of `plan`, in plan order."""
+	if settings.PROJECTION_WORKERS > 1 and len(plan.shards) > 1:
+		yield from parallel.project_shards(
+			plan.shards, plan.date, plan.changed, settings.PROJECTION_WORKERS, recorder
+		)
+		return
+	for user_ids in plan.shards:
+		yield user_ids, project_users(user_ids, plan.date, plan.changed, recorder)
+
+def finish_run(plan):
+	"""Clear the journal entries a run consumed and record a full sweep."""
+	if plan.last_change is not None:
+		ProjectionChange.objects.filter(id__lte=plan.last_change).delete()
+	if plan.full_sweep:
+		ProjectionSweep.objects.get_or_create(date=plan.date)
+
+def project_users(user_ids, current_date, changed=None, recorder=None):
+	"""Project a shard of users and return the rows for MetricsWriter.add.
+
+	`changed` maps user_id to the product ids to recompute; None means all.
+	"""
+	recorder = recorder or RunRecorder(enabled=False)
+	days = [current_date - timedelta(days=i) for i in range(7)]
+	date_list = [day.strftime('%Y-%m-%d') for day in days]
+	next_days = [current_date + timedelta(days=i) for i in range(1, 15)]
+	with recorder.stage('load') as stage:
+		if changed is not None:
+			product_ids = set().union(*(changed.get(user_id, ()) for user_id in user_ids))
+			products = list(Product.objects.filter(id__in=product_ids))
+		else:
+			products = list(Product.objects.all())
+		users = list(User.objects.filter(id__in=user_ids).order_by('id'))
+		sales = prefetch.sales_index(days[-1], current_date, user_ids)
+		onhand = prefetch.onhand_index(days[-1], current_date, user_ids)
+		incoming = prefetch.incoming_index(days[-1], next_days[-1], user_ids)
+		stage['rows'] = len(sales) + len(onhand) + len(incoming)
+
+	collector = RowCollector()
+	with recorder.stage('projection') as stage:
+		for user in users:
+			main_data={}
+
+			for product in products:
+				if changed is not None and product.id not in changed.get(user.id, ()):
+					continue
+				main_data[product]={"sales":{},"lead":product.lead_time,"incoming":{},"onhand":{}}
+				
+				for day, ideal_date in zip(days, date_list):
+					main_data[product]["sales"][ideal_date]=sales.get((user.id, product.id, day), 0)
+					main_data[product]["onhand"][ideal_date]=onhand.get((user.id, product.id, day), 0)
+				for day in days + next_days:
+					main_data[product]["incoming"][day.strftime('%Y-%m-%d')]=incoming.get((user.id, product.id, day), 0)
+				
+			
+			predict_next(main_data=main_data,user=user,writer=collector,current_date=current_date)
+		stage['rows'] = len(collector.rows)
+	return collector.rows
 	
+def predict_next(main_data,user,writer=None,current_date=None):
+	if current_date is None:
+		est = pytz.timezone('America/New_York')
+		current_date = datetime.now(est).date()
+	next_14_days = [current_date + timedelta(days=i) for i in range(1, 15)]
+	products = list(main_data.keys())
+	if not products:
+		return
+	own_writer = writer is None
+	if own_writer:
+		writer = MetricsWriter()
+	today = current_date.strftime('%Y-%m-%d')
+	sales = [list(main_data[p]["sales"].values()) for p in products]
+	on_hand = [main_data[p]["onhand"][today] for p in products]
+	leads = [main_data[p]["lead"] for p in products]
+	incoming = [[main_data[p]["incoming"].get(dt.strftime('%Y-%m-%d'), 0) for dt in next_14_days] for p in products]
+	result = projection.project(sales, on_hand, incoming, leads, horizon=len(next_14_days))
+	for row, product in enumerate(products):
+		for col, dt in enumerate(next_14_days):
+			writer.add(
+				user_id=user.id,
+				product_id=product.id,
+				date=dt,
+				lead_time_days=leads[row],
+				sales=0,
+				on_hand=0,
+				incoming=incoming[row][col],
+				forecast=result['forecast'][row, col],
+				order_point=result['order_point'][row, col],
+				projected_on_hand=result['projected_on_hand'][row, col],
+				soq=result['soq'][row, col],
+				planned_arrival=result['planned_arrival'][row, col],
+			)
+	if own_writer:
+		writer.close()
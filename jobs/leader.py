@@ -0,0 +1,34 @@
+"""Database lease that lets exactly one runner per deployment do the work."""
+import os
+import socket
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api.models import RunnerLease
+
+HOLDER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def acquire(name, ttl, holder=HOLDER):
+	"""Take or renew the lease `name` for `ttl` seconds. Returns True if held."""
+	now = timezone.now()
+	expires_at = now + timedelta(seconds=ttl)
+	taken = RunnerLease.objects.filter(name=name).filter(
+		Q(holder=holder) | Q(expires_at__lt=now)
+	).update(holder=holder, expires_at=expires_at)
+	if taken:
+		return True
+	try:
+		with transaction.atomic():
+			RunnerLease.objects.create(name=name, holder=holder, expires_at=expires_at)
+	except IntegrityError:
+		return False
+	return True
+
+
+def release(name, holder=HOLDER):
+	RunnerLease.objects.filter(name=name, holder=holder).update(expires_at=timezone.now())
@@ -0,0 +1,96 @@
+"""Projection run ledger.
+
+Every run is a ProjectionRun row. Shards are processed in user id order and
+each commits its rows together with the run's watermark (last user id done),
+so a run that crashed or stalled can be resumed after its last shard. Celery
+shards finish in any order, so each records its own user id range instead. A run
+is given PROJECTION_MAX_ATTEMPTS tries; after that it is abandoned, so one
+shard that keeps failing cannot hold back projection work for the whole day.
+"""
+import bisect
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from api.models import ProjectionRun
+
+logger = logging.getLogger(__name__)
+
+
+def _stale_before():
+	return timezone.now() - timedelta(seconds=settings.PROJECTION_LEASE_SECONDS)
+
+
+def live_run(current_date):
+	"""Whether a run for `current_date` is still heartbeating."""
+	return ProjectionRun.objects.filter(
+		run_date=current_date, status='running', heartbeat__gte=_stale_before()
+	).exists()
+
+
+def resumable_run(current_date):
+	"""The latest unfinished run for `current_date` that has attempts left, or None.
+
+	Unfinished runs from earlier days are marked abandoned, since their
+	forecast window no longer applies, and so are today's runs that have used
+	all their attempts.
+	"""
+	unfinished = ProjectionRun.objects.filter(status__in=['running', 'failed'])
+	unfinished.filter(run_date__lt=current_date).update(status='abandoned', finished_at=timezone.now())
+	exhausted = unfinished.filter(run_date=current_date, attempts__gte=settings.PROJECTION_MAX_ATTEMPTS)
+	for run_id in exhausted.values_list('id', flat=True):
+		logger.warning("Abandoning projection run %d after %d attempts", run_id, settings.PROJECTION_MAX_ATTEMPTS)
+	exhausted.update(status='abandoned', finished_at=timezone.now())
+	return unfinished.filter(run_date=current_date).order_by('-id').first()
+
+
+def start(plan):
+	return ProjectionRun.objects.create(
+		run_date=plan.date, full_sweep=plan.full_sweep, last_change=plan.last_change
+	)
+
+
+def resume(run):
+	run.status = 'running'
+	run.attempts += 1
+	run.heartbeat = timezone.now()
+	run.save(update_fields=['status', 'attempts', 'heartbeat'])
+
+
+def checkpoint(run, last_user_id):
+	"""Record that every user up to `last_user_id` is written. Call inside the shard's transaction."""
+	run.watermark = last_user_id
+	run.heartbeat = timezone.now()
+	run.save(update_fields=['watermark', 'heartbeat'])
+
+
+def checkpoint_shard(run_id, user_ids):
+	"""Record one shard committed out of order. Call inside the shard's transaction."""
+	run = ProjectionRun.objects.select_for_update().get(id=run_id)
+	run.done_shards.append([user_ids[0], user_ids[-1]])
+	run.heartbeat = timezone.now()
+	run.save(update_fields=['done_shards', 'heartbeat'])
+
+
+def remaining(run, user_ids):
+	"""`user_ids` less the users `run` has already committed."""
+	done = sorted(run.done_shards)
+	firsts = [first for first, _ in done]
+	left = []
+	for user_id in user_ids:
+		if run.watermark is not None and user_id <= run.watermark:
+			continue
+		# The last shard starting at or before user_id is the only one that can hold it.
+		index = bisect.bisect_right(firsts, user_id) - 1
+		if index >= 0 and user_id <= done[index][1]:
+			continue
+		left.append(user_id)
+	return left
+
+
+def finish(run, status):
+	run.status = status
+	run.finished_at = timezone.now()
+	run.save(update_fields=['status', 'finished_at'])
@@ -0,0 +1,129 @@
+"""OCR workers for queued OcrJobs.
+
+Each worker thread claims up to a batch of pending jobs, answers the ones
+whose image is already cached, and sends the rest to the backend in one
+batch call made outside any transaction. The number of threads caps how many
+calls are in flight against the Vision credential at once. Web requests only
+enqueue jobs (api.ocr.submit), so their latency no longer depends on OCR.
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from api import ocr
+from api.models import OcrJob
+
+logger = logging.getLogger(__name__)
+
+FINISHED_FIELDS = ['status', 'result', 'error', 'content', 'finished_at']
+
+
+def claim(batch_size):
+	"""Mark up to `batch_size` pending jobs running and return them, oldest first.
+
+	Jobs left running past OCR_JOB_TIMEOUT by a worker that died are queued
+	again first, or failed once they have used OCR_MAX_ATTEMPTS.
+	"""
+	now = timezone.now()
+	with transaction.atomic():
+		stale = OcrJob.objects.filter(
+			status='running', started_at__lt=now - timedelta(seconds=settings.OCR_JOB_TIMEOUT),
+		)
+		stale.filter(attempts__gte=settings.OCR_MAX_ATTEMPTS).update(
+			status='failed', error="OCR timed out", content=b'', finished_at=now,
+		)
+		stale.update(status='pending')
+		ids = list(
+			OcrJob.objects.select_for_update(skip_locked=True)
+			.filter(status='pending').order_by('id').values_list('id', flat=True)[:batch_size]
+		)
+		if not ids:
+			return []
+		OcrJob.objects.filter(id__in=ids).update(status='running', started_at=now, attempts=F('attempts') + 1)
+		return list(OcrJob.objects.filter(id__in=ids).order_by('id'))
+
+
+def finish(jobs, results):
+	now = timezone.now()
+	for job in jobs:
+		result = results[job.key]
+		if 'error' in result:
+			job.status, job.result, job.error = 'failed', None, result['error']
+		else:
+			job.status, job.result, job.error = 'done', result, ''
+		job.content = b''
+		job.finished_at = now
+	OcrJob.objects.bulk_update(jobs, FINISHED_FIELDS)
+
+
+def retry(jobs, error):
+	"""Queue the jobs again after a failed backend call, or fail the ones out of attempts."""
+	now = timezone.now()
+	for job in jobs:
+		if job.attempts < settings.OCR_MAX_ATTEMPTS:
+			job.status = 'pending'
+		else:
+			job.status, job.error, job.content, job.finished_at = 'failed', error, b'', now
+	OcrJob.objects.bulk_update(jobs, ['status', 'error', 'content', 'finished_at'])
+
+
+def process_batch(batch_size):
+	"""Claim and answer one batch of jobs with at most one backend call. Returns the jobs claimed."""
+	jobs = claim(batch_size)
+	if not jobs:
+		return 0
+	results = ocr.cached(job.key for job in jobs)
+	# Jobs for the same image share one request.
+	images = {}
+	for job in jobs:
+		if job.key not in results:
+			images.setdefault(job.key, (bytes(job.content), job.feature))
+	if images:
+		try:
+			answers = ocr.get_backend().annotate(list(images.values()))
+		except Exception as exc:
+			logger.exception("OCR batch of %d images failed", len(images))
+			retry(jobs, str(exc))
+			return len(jobs)
+		fresh = dict(zip(images, answers))
+		ocr.store({key: (images[key][1], result) for key, result in fresh.items()})
+		results.update(fresh)
+	finish(jobs, results)
+	logger.debug("OCR batch: %d jobs, %d backend images", len(jobs), len(images))
+	return len(jobs)
+
+
+def work(batch_size, idle_seconds, stop, once=False):
+	"""One worker thread: process batches until `stop` is set, or with `once` until the queue is empty."""
+	try:
+		while not stop.is_set():
+			if not process_batch(batch_size):
+				if once:
+					return
+				stop.wait(idle_seconds)
+	finally:
+		connections.close_all()
+
+
+def run(concurrency, batch_size, idle_seconds=1, once=False):
+	"""Run `concurrency` worker threads, each with at most one backend call in flight."""
+	stop = threading.Event()
+	threads = [
+		threading.Thread(target=work, args=(batch_size, idle_seconds, stop, once), name=f"ocr-{i}")
+		for i in range(concurrency)
+	]
+	for thread in threads:
+		thread.start()
+	try:
+		for thread in threads:
+			while thread.is_alive():
+				thread.join(timeout=1)
+	except KeyboardInterrupt:
+		stop.set()
+		for thread in threads:
+			thread.join()
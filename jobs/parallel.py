@@ -0,0 +1,53 @@
+"""Run projection shards on a process pool.
+
+Workers compute rows with their own database connection and send them back;
+the calling process stays the only writer. Each worker measures its load and
+projection stages and sends them back too, so a run records the same stages
+in parallel as it does serially.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _init_worker():
+	os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+	import django
+	django.setup()
+	from django.db import connections
+	connections.close_all()
+
+
+def _project_shard(user_ids, current_date, changed, instrument):
+	from django.db import connections
+	from .instrument import RunRecorder
+	from .jobs import project_users
+	# Stage totals only; profiles stay with the parent's stages.
+	recorder = RunRecorder(enabled=instrument, profile_dir='')
+	try:
+		return project_users(user_ids, current_date, changed, recorder), recorder.stages
+	finally:
+		connections.close_all()
+
+
+def project_shards(shards, current_date, changed, workers, recorder=None):
+	"""Project `shards` (lists of user ids) on `workers` processes.
+
+	Yields (user_ids, rows) in shard order while later shards keep computing,
+	adding each worker's stage measurements to `recorder`.
+	"""
+	from django.db import connections
+	# Forked workers must not share the parent's open connection.
+	connections.close_all()
+	subsets = [
+		None if changed is None else {user_id: changed[user_id] for user_id in user_ids}
+		for user_ids in shards
+	]
+	with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+		instrument = recorder is not None and recorder.enabled
+		results = pool.map(
+			_project_shard, shards, [current_date] * len(shards), subsets, [instrument] * len(shards)
+		)
+		for user_ids, (rows, stages) in zip(shards, results):
+			if recorder is not None:
+				recorder.merge(stages)
+			yield user_ids, rows
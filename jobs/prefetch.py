@@ -0,0 +1,33 @@
+"""Bulk loaders for the projection inputs.
+
+Each history table is read once per run with one query over the date
+window, through its (user, date) index, and turned into a dict keyed by
+(user_id, product_id, date).
+"""
+
+from api.models import DailySalesRollup, OldUserInventory, OldIncomingInventory
+
+
+def build_index(queryset, date_field, start, end, user_ids=None, value_field='quantity'):
+	"""Map (user_id, product_id, date) to `value_field` for start <= date <= end.
+
+	The history tables are unique on (user, product, date), so there is at
+	most one row per key and nothing to aggregate.
+	"""
+	queryset = queryset.filter(**{date_field + '__range': (start, end)})
+	if user_ids is not None:
+		queryset = queryset.filter(user_id__in=user_ids)
+	rows = queryset.order_by().values_list('user_id', 'product_id', date_field, value_field)
+	return {(user_id, product_id, day): value for user_id, product_id, day, value in rows}
+
+
+def onhand_index(start, end, user_ids=None):
+	return build_index(OldUserInventory.objects.all(), 'date', start, end, user_ids)
+
+
+def incoming_index(start, end, user_ids=None):
+	return build_index(OldIncomingInventory.objects.all(), 'arrival_date', start, end, user_ids)
+
+
+def sales_index(start, end, user_ids=None):
+	return build_index(DailySalesRollup.objects.all(), 'date', start, end, user_ids, value_field='qty')
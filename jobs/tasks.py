@@ -0,0 +1,108 @@
+"""Celery tasks that fan a projection run out over the worker pool.
+
+run_projections plans the run and starts a chord: one project_shard task per
+shard of users, then finalize_run once every shard has been written.
+"""
+import logging
+import uuid
+from datetime import date
+
+from celery import chord, shared_task
+from django.conf import settings
+from django.db import transaction
+
+from api.models import ProjectionRun
+
+from . import leader, ledger
+from .jobs import RunPlan, finish_run, prepare_run, project_users, run_date
+from .updater import LEASE
+from .writer import MetricsWriter
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def run_projections():
+	"""Plan a projection run and fan its shards out as a chord."""
+	current_date = run_date()
+	if current_date is None:
+		return None
+	# The lease belongs to the run, not to this worker, so finalize_run can
+	# release it from whichever worker executes it.
+	holder = f"celery:{uuid.uuid4().hex}"
+	if not leader.acquire(LEASE, settings.PROJECTION_LEASE_SECONDS, holder=holder):
+		logger.info("Projection lease is held by another runner, skipping")
+		return None
+	handed_off = False
+	try:
+		if ledger.live_run(current_date):
+			return None
+		resumed = ledger.resumable_run(current_date)
+		plan = prepare_run(current_date, resume=resumed)
+		if plan is None:
+			return 0
+		if resumed is None:
+			run = ledger.start(plan)
+		else:
+			run = resumed
+			ledger.resume(run)
+		header = [
+			project_shard.s(user_ids, current_date.isoformat(), _shard_changes(plan.changed, user_ids), run.id)
+			for user_ids in plan.shards
+		]
+		finalize = finalize_run.s(run.id, holder)
+		if not header:
+			finalize.delay([])
+		else:
+			chord(header)(finalize)
+		handed_off = True
+		return len(header)
+	finally:
+		# Once finalize_run is queued it owns the lease.
+		if not handed_off:
+			leader.release(LEASE, holder=holder)
+
+
+@shared_task
+def project_shard(user_ids, run_day, changes=None, run_id=None):
+	"""Project one shard of users and write its rows atomically. Returns writer counts.
+
+	With `run_id`, the shard is checkpointed on its run in the same
+	transaction, so a resumed run skips it.
+	"""
+	changed = None if changes is None else {user_id: set(products) for user_id, products in changes}
+	rows = project_users(user_ids, date.fromisoformat(run_day), changed)
+	writer = MetricsWriter()
+	with transaction.atomic():
+		for row in rows:
+			writer.add(**row)
+		writer.flush()
+		if run_id is not None:
+			ledger.checkpoint_shard(run_id, user_ids)
+	return writer.close()
+
+
+@shared_task
+def finalize_run(results, run_id, holder):
+	run = ProjectionRun.objects.get(id=run_id)
+	plan = RunPlan(run.run_date, run.full_sweep, run.last_change, None, None)
+	with transaction.atomic():
+		finish_run(plan)
+		ledger.finish(run, 'succeeded')
+	leader.release(LEASE, holder=holder)
+	totals = {
+		name: sum(result[name] for result in results) for name in ('inserted', 'updated', 'deleted', 'skipped')
+	}
+	logger.info(
+		"Projection run %d for %s finished: %d shards, %d inserted, %d updated, %d deleted, %d skipped",
+		run.id, run.run_date, len(results), totals['inserted'], totals['updated'], totals['deleted'],
+		totals['skipped'],
+	)
+	return totals
+
+
+def _shard_changes(changed, user_ids):
+	# JSON task arguments cannot carry int dict keys or sets.
+	if changed is None:
+		return None
+	return [[user_id, sorted(changed[user_id])] for user_id in user_ids]
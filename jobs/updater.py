@@ -1,13 +1,31 @@
-from datetime import datetime
-from apscheduler.schedulers.background import BackgroundScheduler
+import logging
+
+from apscheduler.schedulers.blocking import BlockingScheduler
+from django.conf import settings
+from django.utils import timezone
+
+from . import leader
 from .jobs import schedule_api
-from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+LEASE = 'projections'
+
+
+def run_once():
+	"""Run the projection job if this process holds the runner lease."""
+	if not leader.acquire(LEASE, settings.PROJECTION_LEASE_SECONDS):
+		logger.info("Projection lease is held by another runner, skipping")
+		return False
+	schedule_api()
+	return True
+
 
 def start():
-	
-	scheduler = BackgroundScheduler()
-	scheduler.remove_all_jobs()
-	scheduler.start()
-	scheduler.add_job(schedule_api, 'interval', seconds=300,coalesce=True,
-        max_instances=1)
-	# 
\ No newline at end of file
+	scheduler = BlockingScheduler()
+	scheduler.add_job(run_once, 'interval', seconds=settings.PROJECTION_INTERVAL, coalesce=True,
+		max_instances=1, next_run_time=timezone.now())
+	try:
+		scheduler.start()
+	finally:
+		leader.release(LEASE)
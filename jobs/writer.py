@@ -0,0 +1,140 @@
+"""Chunked upsert writer for projected DailyInventoryMetrics rows."""
+import logging
+from decimal import Decimal
+
+from django.db import transaction
+
+from api import projection_cache
+from api.models import DailyInventoryMetrics
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+UNIQUE_FIELDS = ['user', 'product', 'date', 'is_projection']
+DECIMAL_FIELDS = [
+	'sales', 'on_hand', 'incoming', 'order_point', 'forecast',
+	'projected_on_hand', 'soq', 'planned_arrival',
+]
+UPDATE_FIELDS = DECIMAL_FIELDS + ['lead_time_days']
+
+
+def to_decimal(value):
+	return Decimal(repr(float(value))).quantize(CENT)
+
+
+class MetricsWriter:
+	"""Buffer projection rows and upsert them into DailyInventoryMetrics.
+
+	Rows are flushed in chunks of `chunk_size`, each chunk in its own
+	transaction. Rows whose stored values are already identical are skipped.
+	All-zero rows are not stored, and a stored projection that has become
+	all zeros is deleted, so no stale SOQ outlives a run.
+
+	Once a flush commits, the projection cache version of every user passed
+	to add() is bumped.
+	"""
+
+	def __init__(self, chunk_size=2000):
+		self.chunk_size = chunk_size
+		self.pending = []
+		self.inserted = 0
+		self.updated = 0
+		self.skipped = 0
+		self.deleted = 0
+		self.zeroed = []
+		self.users = set()
+
+	def add(self, user_id, product_id, date, lead_time_days, **metrics):
+		self.users.add(user_id)
+		# Same rule savedb used: all-zero projections are not stored.
+		if not (metrics['order_point'] or metrics['forecast'] or metrics['soq']):
+			self.zeroed.append((user_id, product_id, date))
+			if len(self.zeroed) >= self.chunk_size:
+				self.flush()
+			return
+		values = {name: to_decimal(metrics.get(name, 0)) for name in DECIMAL_FIELDS}
+		self.pending.append(DailyInventoryMetrics(
+			user_id=user_id,
+			product_id=product_id,
+			date=date,
+			is_projection=True,
+			lead_time_days=lead_time_days,
+			**values
+		))
+		if len(self.pending) >= self.chunk_size:
+			self.flush()
+
+	def _existing(self, keys):
+		"""Stored projections among `keys`.
+
+		Returns {(user_id, product_id, date): (id, *UPDATE_FIELDS values)}.
+		"""
+		stored = DailyInventoryMetrics.objects.filter(
+			is_projection=True,
+			user_id__in={key[0] for key in keys},
+			product_id__in={key[1] for key in keys},
+			date__in={key[2] for key in keys},
+		).values_list('user_id', 'product_id', 'date', 'id', *UPDATE_FIELDS)
+		return {tuple(values[:3]): tuple(values[3:]) for values in stored}
+
+	def flush(self):
+		rows, self.pending = self.pending, []
+		zeroed, self.zeroed = self.zeroed, []
+		users, self.users = self.users, set()
+		if rows or zeroed:
+			self._write(rows, zeroed)
+		# Registered after the write, so outside a transaction it runs once
+		# the rows are committed.
+		if users:
+			transaction.on_commit(lambda: projection_cache.bump(users))
+
+	def _write(self, rows, zeroed):
+		with transaction.atomic():
+			keys = [(row.user_id, row.product_id, row.date) for row in rows]
+			existing = self._existing(keys + zeroed)
+			stale = [existing[key][0] for key in zeroed if key in existing]
+			self.deleted += len(stale)
+			self.skipped += len(zeroed) - len(stale)
+			if stale:
+				DailyInventoryMetrics.objects.filter(id__in=stale).delete()
+			changed = []
+			for row in rows:
+				key = (row.user_id, row.product_id, row.date)
+				current = existing.get(key)
+				if current is None:
+					self.inserted += 1
+				elif current[1:] == tuple(getattr(row, name) for name in UPDATE_FIELDS):
+					self.skipped += 1
+					continue
+				else:
+					self.updated += 1
+				changed.append(row)
+			DailyInventoryMetrics.objects.bulk_create(
+				changed,
+				update_conflicts=True,
+				unique_fields=UNIQUE_FIELDS,
+				update_fields=UPDATE_FIELDS,
+			)
+
+	def close(self):
+		self.flush()
+		logger.info(
+			"Projection rows: %d inserted, %d updated, %d deleted, %d skipped",
+			self.inserted, self.updated, self.deleted, self.skipped,
+		)
+		return {
+			'inserted': self.inserted,
+			'updated': self.updated,
+			'deleted': self.deleted,
+			'skipped': self.skipped,
+		}
+
+
+class RowCollector:
+	"""Stand-in for MetricsWriter that keeps rows in memory, for shard workers."""
+
+	def __init__(self):
+		self.rows = []
+
+	def add(self, **row):
+		self.rows.append(row)